@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import argparse
+
+import glob as gb
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
+sys.path.insert(0, root)                                               # nopep8
+
+from helper.timer import Timer
+from common.logger import Logger
+from common.session import Session
+from loader.crawler import Crawler
+
+
+def record(subreddit, config, pages, path):
+    logger = Logger('crawler', f'r/{subreddit}', plain=False)
+    os.makedirs(path, exist_ok=True)
+
+    # record listing pages of each backend
+    for backend, endpoint in Crawler.endpoints.items():
+        parse = getattr(Crawler, f'parse_{backend}')
+        url, page = endpoint.format(subreddit), 0
+        while url and page < pages:
+            content = Session.shared(url, config).get(url).content
+            with open(os.path.join(path, f'{backend}.{page}.{backend}'), 'wb') as f:
+                f.write(content)
+            url = dict(parse(content, url)).get('next')
+            page += 1
+        logger.log(f'recorded {page} {backend} pages')
+
+
+def benchmark(subreddit, repeat, path):
+    logger = Logger('crawler', f'r/{subreddit}', plain=False)
+
+    for backend in Crawler.endpoints:
+        parse = getattr(Crawler, f'parse_{backend}')
+
+        # load recorded pages
+        fixtures = []
+        for file_path in sorted(gb.glob(os.path.join(path, f'{backend}.*.{backend}'))):
+            with open(file_path, 'rb') as f:
+                fixtures.append(f.read())
+        if not any(fixtures):
+            logger.log(f'no {backend} fixtures in {path}')
+            continue
+
+        # parse pages repeatedly
+        items = 0
+        timer = Timer()
+        for _ in range(repeat):
+            for content in fixtures:
+                items += sum(1 for tag, _ in parse(content, Crawler.endpoints[backend].format(subreddit)) if tag == 'thing')
+        seconds = timer.stop() / 1000
+
+        # parse throughput
+        size = sum(len(x) for x in fixtures) * repeat / 1024 / 1024
+        logger.log(f'{backend:>4} | {len(fixtures) * repeat / seconds:10.1f} pages/s | {items / seconds:10.1f} items/s | {size / seconds:8.2f} MB/s')
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser()
+    argp.add_argument('subreddit', type=str, nargs='?', default='Python', help='subreddit of recorded listing pages')
+    argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
+    argp.add_argument('-fixtures', type=str, default=os.path.join('benchmark', 'fixtures', 'crawler'), help='directory of recorded listing pages')
+    argp.add_argument('-record', type=int, default=0, help='record x listing pages per backend into fixtures before benchmarking')
+    argp.add_argument('-repeat', type=int, default=20, help='parse recorded pages x times')
+    args = argp.parse_args()
+
+    # load config
+    with open(os.path.join(root, args.config)) as f:
+        config = json.load(f)
+
+    # recorded fixtures
+    path = os.path.join(root, args.fixtures)
+    if args.record:
+        record(args.subreddit, config, args.record, path)
+
+    # compare parse throughput
+    benchmark(args.subreddit, args.repeat, path)
@@ -0,0 +1,55 @@
+import os
+import sys
+import argparse
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
+sys.path.insert(0, root)                                               # nopep8
+
+from helper.timer import Timer
+from common.logger import Logger
+
+
+def importtime(module):
+    # cold import in a fresh interpreter
+    timer = Timer()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=root, capture_output=True, text=True)
+    total = timer.stop()
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().split('\n')[-1])
+
+    # cumulative import time of third party packages in milliseconds
+    packages = {}
+    for line in result.stderr.split('\n'):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+
+        # skip interpreter startup and local modules
+        package = name.strip().split('.')[0]
+        if not name[1:].startswith(' ') or package in ['data', 'helper', 'common', 'loader', 'benchmark']:
+            continue
+        packages[package] = max(packages.get(package, 0), int(cumulative) / 1000)
+
+    return total, packages
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser()
+    argp.add_argument('modules', type=str, nargs='*', default=['data', 'loader.crawler', 'loader.pushshift', 'loader.praw', 'common.store', 'common.export'], help='entry point modules to import')
+    argp.add_argument('-repeat', type=int, default=5, help='import each module x times')
+    argp.add_argument('-top', type=int, default=5, help='show x slowest top level imports')
+    args = argp.parse_args()
+
+    logger = Logger('main', 'startup', plain=False)
+    for module in args.modules:
+        try:
+            runs = [importtime(module) for _ in range(args.repeat)]
+        except ImportError as e:
+            logger.log(f'{module:<16} | ...import error {e}')
+            continue
+
+        # best run of all repeats
+        total, packages = min(runs, key=lambda x: x[0])
+        slowest = sorted(packages.items(), key=lambda x: x[1], reverse=True)[:args.top]
+        logger.log(f'{module:<16} | {total:8.1f} ms | ' + ', '.join(f'{name} {ms:.1f} ms' for name, ms in slowest))
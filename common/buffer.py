@@ -0,0 +1,55 @@
+import time
+
+import pandas as pd
+
+from threading import RLock
+
+
+class Buffer(object):
+    def __init__(self, store, name, rows, size, seconds):
+        self.store = store
+        self.name = name
+
+        # flush thresholds
+        self.rows = rows
+        self.size = size
+        self.seconds = seconds
+
+        self.lock = RLock()
+        self.reset()
+
+    def reset(self):
+        self.frames = []
+        self.meta = {}
+        self.count = 0
+        self.bytes = 0
+        self.stamp = time.monotonic()
+
+    def add(self, data, **kwargs):
+        with self.lock:
+            # buffer rows
+            if not data.empty:
+                self.frames.append(data)
+                self.count += data.shape[0]
+                self.bytes += data.memory_usage(deep=True).sum()
+            self.meta = kwargs
+
+            # flush on thresholds
+            if self.count >= self.rows or self.bytes >= self.size or time.monotonic() - self.stamp >= self.seconds:
+                return self.flush()
+
+            return 0
+
+    def flush(self):
+        with self.lock:
+            count = self.count
+
+            # write buffered rows and state
+            if len(self.frames):
+                df = pd.concat(self.frames).sort_values(by=['created', 'retrieved'])
+                self.store.write_data(self.name, df, overwrite=False, **self.meta)
+            elif len(self.meta):
+                self.store.write_meta(self.name, **self.meta)
+
+            self.reset()
+            return count
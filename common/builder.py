@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from array import array
+
+
+class Builder(object):
+
+    # typed array codes
+    codes = {
+        'bool': 'b',
+        'int8': 'b',
+        'int32': 'i',
+        'uint32': 'I',
+        'int64': 'q',
+        'float32': 'f',
+        'float64': 'd'
+    }
+
+    def __init__(self, columns):
+        self.columns = columns
+
+        # column builders
+        self.values = {}
+        self.lookups = {}
+        self.appends = []
+        for column, dtype in self.columns.items():
+            if dtype in Builder.codes:
+                # typed numbers
+                self.values[column] = array(Builder.codes[dtype])
+                self.appends.append(self.values[column].append)
+            elif dtype == 'category':
+                # dictionary encoded strings
+                self.values[column] = array('i')
+                self.lookups[column] = {}
+                self.appends.append(self.encoder(self.values[column], self.lookups[column]))
+            else:
+                # unique text
+                self.values[column] = []
+                self.appends.append(self.values[column].append)
+
+        self.count = 0
+
+    @staticmethod
+    def encoder(codes, lookup):
+        def append(value):
+            codes.append(-1 if value is None else lookup.setdefault(value, len(lookup)))
+        return append
+
+    def __len__(self):
+        return self.count
+
+    def add(self, *values):
+        for append, value in zip(self.appends, values):
+            append(value)
+        self.count += 1
+
+    def frame(self, index):
+        data = {}
+        for column, dtype in self.columns.items():
+            values = self.values[column]
+            if dtype in Builder.codes:
+                data[column] = np.frombuffer(values, dtype=dtype if dtype != 'bool' else 'int8').astype(dtype) if len(values) else np.empty(0, dtype=dtype)
+            elif dtype == 'category':
+                data[column] = pd.Categorical.from_codes(np.array(values, dtype='int32'), categories=list(self.lookups[column]))
+            else:
+                data[column] = np.array(values, dtype=object)
+
+        return pd.DataFrame(data, columns=list(self.columns)).set_index(index)
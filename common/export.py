@@ -0,0 +1,225 @@
+import io
+import os
+import sys
+import csv
+import json
+import shutil
+import hashlib
+import argparse
+
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
+sys.path.insert(0, root)                                               # nopep8
+
+from helper.timer import Timer
+from common.store import Store
+from common.schema import Schema
+from common.logger import Logger
+
+
+class Export(object):
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+        # export file
+        self.path = os.path.join(self.store.root, 'data', 'export', self.store.subreddit, f'{self.name}.csv')
+
+        # rendered partitions
+        self.cache = os.path.join(self.store.root, 'data', 'cache', 'export', self.store.subreddit, self.name)
+
+    def read_manifest(self):
+        path = os.path.join(self.cache, 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'header': None, 'shards': {}, 'order': [], 'size': None, 'mtime': None}
+
+    def write_manifest(self, manifest):
+        path = os.path.join(self.cache, 'manifest.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(f'{path}.tmp', path)
+
+    def valid(self, manifest):
+        # export file unchanged since last run
+        if not os.path.exists(self.path):
+            return False
+        stat = os.stat(self.path)
+        return stat.st_size == manifest['size'] and stat.st_mtime_ns == manifest['mtime']
+
+    def run(self, keys=None, full=False):
+        # keep partitions stable while they are rendered
+        with self.store.lock:
+            os.makedirs(self.cache, exist_ok=True)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            # stored partitions, flat data is a single partition
+            partitioned = self.store.partitioned(self.name)
+            order = self.store.partitions(self.name) if partitioned else ['all'] if self.store.exists_data(self.name) else []
+            if not any(order):
+                return 0
+
+            # obtain changed partitions
+            manifest = self.read_manifest()
+            if full or not partitioned:
+                changed = set(order)
+            else:
+                changed = {x for x in order if x in (keys or []) or x not in manifest['shards'] or not os.path.exists(self.shard(x))}
+
+            # render changed partitions
+            header = manifest['header']
+            for key in sorted(changed):
+                header, manifest['shards'][key] = self.render(key, partitioned)
+            for key in set(manifest['shards']) - set(order):
+                manifest['shards'].pop(key)
+                if os.path.exists(self.shard(key)):
+                    os.remove(self.shard(key))
+
+            # keep unchanged leading partitions of the export file
+            prefix = 0
+            if not full and self.valid(manifest) and header == manifest['header']:
+                for old, new in zip(manifest['order'], order):
+                    if old != new or new in changed:
+                        break
+                    prefix += 1
+
+            # patch or rewrite export file in a temporary copy, readers never see partial files
+            with open(f'{self.path}.tmp', 'wb') as f:
+                if prefix:
+                    offset = len(header.encode('utf-8')) + sum(manifest['shards'][x]['size'] for x in order[:prefix])
+                    with open(self.path, 'rb') as source:
+                        Export.copy(source, f, offset)
+                    self.assemble(f, order[prefix:])
+                else:
+                    f.write(header.encode('utf-8'))
+                    self.assemble(f, order)
+            os.replace(f'{self.path}.tmp', self.path)
+
+            # update manifest
+            stat = os.stat(self.path)
+            manifest.update({'header': header, 'order': order, 'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+            self.write_manifest(manifest)
+
+            # update stats sidecar
+            shards = [manifest['shards'][x] for x in order]
+            self.write_stats({
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'count': sum(x['rows'] for x in shards),
+                'created': [min(x['created'][0] for x in shards), max(x['created'][1] for x in shards)],
+                'dtypes': Export.combine([x['dtypes'] for x in shards]),
+                'hash': hashlib.sha256((header + ''.join(x['hash'] for x in shards)).encode('utf-8')).hexdigest()
+            })
+
+            return sum(x['rows'] for x in shards)
+
+    def write_stats(self, stats):
+        path = Export.sidecar(self.path)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(stats, f, indent=4)
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def sidecar(path):
+        # data/export/<subreddit>/<name>.csv -> data/cache/export/<subreddit>/<name>.json
+        data = os.path.dirname(os.path.dirname(os.path.dirname(path)))
+        subreddit = os.path.basename(os.path.dirname(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(data, 'cache', 'export', subreddit, f'{name}.json')
+
+    @staticmethod
+    def read_stats(path):
+        sidecar = Export.sidecar(path)
+        if not os.path.exists(sidecar) or not os.path.exists(path):
+            return None
+
+        # validate sidecar against export file
+        with open(sidecar) as f:
+            stats = json.load(f)
+        stat = os.stat(path)
+        if stat.st_size != stats['size'] or stat.st_mtime_ns != stats['mtime']:
+            return None
+
+        return stats
+
+    @staticmethod
+    def combine(dtypes):
+        combined = {}
+        for columns in dtypes:
+            for column, dtype in columns.items():
+                current = combined.get(column, dtype)
+
+                # widen datatypes like a single csv parse would
+                if current != dtype:
+                    dtype = 'float64' if {current, dtype} <= {'int64', 'float64'} else 'object'
+                combined[column] = dtype
+
+        return combined
+
+    def render(self, key, partitioned):
+        with Timer.span('read_data'):
+            df = self.store.read_partition(self.name, key) if partitioned else self.store.read_data(self.name)
+
+        # convert datatypes
+        with Timer.span('dtypes'):
+            df = Schema.csv(df)
+            df = df.sort_values(by=['created', 'retrieved'])
+
+        # render csv rows
+        with Timer.span('to_csv'):
+            header = df.head(0).to_csv(header=True, index=True, doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',')
+            rows = df.to_csv(header=False, index=True, doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',').encode('utf-8')
+            with open(f'{self.shard(key)}.tmp', 'wb') as f:
+                f.write(rows)
+            os.replace(f'{self.shard(key)}.tmp', self.shard(key))
+
+        # parse datatypes as readers of the export file will
+        with Timer.span('read_csv'):
+            df = pd.read_csv(io.BytesIO(header.encode('utf-8') + rows), doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',', encoding='utf-8')
+
+        return header, {
+            'rows': df.shape[0],
+            'size': len(rows),
+            'hash': hashlib.sha256(rows).hexdigest(),
+            'created': [int(df['created'].min()), int(df['created'].max())],
+            'dtypes': df.dtypes.astype(str).to_dict()
+        }
+
+    def shard(self, key):
+        return os.path.join(self.cache, f'{key}.csv')
+
+    @staticmethod
+    def copy(source, f, size):
+        # copy leading bytes of unchanged partitions
+        while size > 0:
+            chunk = source.read(min(size, 1024 * 1024))
+            if not chunk:
+                break
+            f.write(chunk)
+            size -= len(chunk)
+
+    def assemble(self, f, keys):
+        for key in keys:
+            with open(self.shard(key), 'rb') as shard:
+                shutil.copyfileobj(shard, f)
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser()
+    argp.add_argument('subreddits', type=str, nargs='+', help='subreddits to export')
+    argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
+    args = argp.parse_args()
+
+    # load config
+    with open(os.path.join(root, args.config)) as f:
+        config = json.load(f)
+
+    # full re-export
+    for subreddit in args.subreddits:
+        logger = Logger('main', f'r/{subreddit}', plain=False)
+        store = Store('praw', root, config, subreddit)
+        for file_type in config['praw']['types']:
+            count = Export(store, file_type).run(full=True)
+            logger.log(f'exported {count} {file_type}s')
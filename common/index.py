@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+
+from threading import Lock, RLock
+
+
+class Index(object):
+
+    # shared indexes
+    paths = {}
+    paths_lock = Lock()
+
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+
+        # sorted ids and appended ids
+        self.sorted = np.empty(0, dtype='int64')
+        self.appended = np.empty(0, dtype='int64')
+
+        # file state
+        self.stamp = None
+        self.offset = 0
+
+        self.lock = RLock()
+
+    @staticmethod
+    def shared(path, threshold=65536):
+        with Index.paths_lock:
+            if path not in Index.paths:
+                Index.paths[path] = Index(path, threshold)
+            return Index.paths[path]
+
+    @staticmethod
+    def encode(ids):
+        # reddit ids are base 36 numbers
+        return np.fromiter((int(x, 36) for x in ids), dtype='int64', count=len(ids))
+
+    def exists(self):
+        return os.path.exists(f'{self.path}.npy')
+
+    def refresh(self):
+        # reload sorted ids on change
+        stat = os.stat(f'{self.path}.npy') if self.exists() else None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size) if stat else None
+        if stamp != self.stamp:
+            self.sorted = np.load(f'{self.path}.npy') if stat else np.empty(0, dtype='int64')
+            self.appended = np.empty(0, dtype='int64')
+            self.stamp = stamp
+            self.offset = 0
+
+        # read appended ids
+        log = f'{self.path}.log'
+        size = os.path.getsize(log) if os.path.exists(log) else 0
+        size -= size % 8
+        if size < self.offset:
+            self.appended = np.empty(0, dtype='int64')
+            self.offset = 0
+        if size > self.offset:
+            with open(log, 'rb') as f:
+                f.seek(self.offset)
+                self.appended = np.concatenate([self.appended, np.frombuffer(f.read(size - self.offset), dtype='int64')])
+            self.offset = size
+
+    def contains(self, ids):
+        with self.lock:
+            self.refresh()
+            values = Index.encode(ids)
+
+            # binary search sorted ids
+            found = np.zeros(len(values), dtype=bool)
+            if len(self.sorted):
+                positions = np.minimum(np.searchsorted(self.sorted, values), len(self.sorted) - 1)
+                found = self.sorted[positions] == values
+
+            # linear search appended ids
+            return found | np.isin(values, self.appended)
+
+    def add(self, ids):
+        with self.lock:
+            values = Index.encode(ids)
+
+            # append ids to log
+            with open(f'{self.path}.log', 'ab') as f:
+                f.write(values.tobytes())
+            self.refresh()
+
+            # merge log into sorted ids above threshold
+            if len(self.appended) > max(self.threshold, len(self.sorted) // 8):
+                self.reset(np.concatenate([self.sorted, self.appended]), encoded=True)
+
+    def reset(self, ids, encoded=False):
+        with self.lock:
+            values = np.unique(ids if encoded else Index.encode(ids))
+
+            # replace sorted ids atomically
+            temp = f'{self.path}.tmp'
+            with open(temp, 'wb') as f:
+                np.save(f, values)
+            os.replace(temp, f'{self.path}.npy')
+
+            # clear log
+            if os.path.exists(f'{self.path}.log'):
+                os.remove(f'{self.path}.log')
+
+            self.refresh()
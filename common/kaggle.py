@@ -1,6 +1,9 @@
 import os
 import csv
 import json
+import shutil
+import zipfile
+import hashlib
 import tempfile
 
 import glob as gb
@@ -8,16 +11,25 @@ import pandas as pd
 
 from helper.env import Env
 from helper.timer import Timer
+from common.lock import FileLock
+from common.export import Export
+from common.worker import Worker
+from common.metrics import Metrics
+from common.schema import Schema
 
 from datetime import datetime, timezone
-from kaggle.api.kaggle_api_extended import KaggleApi
 
 
 class Kaggle(object):
-    def __init__(self, config):
+    def __init__(self, config, api=None):
         self.config = config
 
-        self.kaggle = KaggleApi()
+        # kaggle api or local stand-in, kaggle reads credentials from the environment
+        if api is None:
+            Env.init()
+            from kaggle.api.kaggle_api_extended import KaggleApi
+            api = KaggleApi()
+        self.kaggle = api
         self.kaggle.authenticate()
 
         self.descriptions = {
@@ -55,7 +67,12 @@ class Kaggle(object):
 
         self.datatypes = {
             'object': 'string',
+            'category': 'string',
+            'bool': 'boolean',
+            'int32': 'integer',
+            'uint32': 'integer',
             'int64': 'integer',
+            'float32': 'number',
             'float64': 'number',
             'datetime64[ns]': 'datetime'
         }
@@ -79,11 +96,11 @@ class Kaggle(object):
         summary = {}
         resources = []
 
-        # read metadata from files
-        for file_path in sorted(gb.glob(os.path.join(root, '**', '*.csv'))):
-            df = pd.read_csv(file_path, doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',', encoding='utf-8')
+        # read metadata from files, scans run in worker processes
+        file_paths = sorted(gb.glob(os.path.join(root, '**', '*.csv')))
+        for file_path, stats in zip(file_paths, Worker.map(Kaggle.stats, file_paths)):
 
-            count = df.shape[0]
+            count = stats['count']
             name = os.path.basename(file_path)
             path = os.path.join(*(file_path.split(os.path.sep)[2:]))
             link = f'r/{os.path.dirname(path)}'
@@ -93,9 +110,9 @@ class Kaggle(object):
                 continue
 
             # build description
-            time_from = datetime.fromtimestamp(df['created'].min()).strftime('%Y-%m-%d %H:%M:%S')
-            time_to = datetime.fromtimestamp(df['created'].max()).strftime('%Y-%m-%d %H:%M:%S')
-            description = f'[{link}](https://reddit.com/{link}) | {time_from} | {time_to} | *{df.shape[0]}*'
+            time_from = datetime.fromtimestamp(stats['created'][0]).strftime('%Y-%m-%d %H:%M:%S')
+            time_to = datetime.fromtimestamp(stats['created'][1]).strftime('%Y-%m-%d %H:%M:%S')
+            description = f'[{link}](https://reddit.com/{link}) | {time_from} | {time_to} | *{count}*'
 
             # build ressources
             resources.append({
@@ -107,8 +124,8 @@ class Kaggle(object):
                         'name': f'{column}',
                         'title': f'{column}',
                         'description': self.descriptions[name.split('.')[0]][column],
-                        'type': self.datatypes[df.dtypes.astype(str)[column]]
-                    } for column in df.columns]
+                        'type': self.datatypes[Schema.dtypes(name).get(column, dtype)]
+                    } for column, dtype in stats['dtypes'].items()]
                 }
             })
 
@@ -140,5 +157,150 @@ class Kaggle(object):
         # update message
         return f'{md_date} - {sum([x for x in summary.values()])}'
 
+    @staticmethod
+    def stats(file_path):
+        # read stats sidecar
+        stats = Export.read_stats(file_path)
+        if stats is not None:
+            return stats
+
+        # scan file in chunks
+        count, created, dtypes = 0, [], []
+        for df in pd.read_csv(file_path, doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',', encoding='utf-8', chunksize=100000):
+            count += df.shape[0]
+            created += [df['created'].min(), df['created'].max()]
+            dtypes.append(df.dtypes.astype(str).to_dict())
+
+        return {
+            'count': count,
+            'created': [min(created), max(created)] if count else [],
+            'dtypes': Export.combine(dtypes)
+        }
+
+    @staticmethod
+    def lock(root, folder):
+        # subreddit exports are written under the lock of their store
+        return FileLock.shared(os.path.join(os.path.dirname(root), 'store', folder, '.lock'))
+
+    def hashes(self, root):
+        hashes = {}
+
+        # hash export files, sidecar hashes avoid reading the files
+        for folder in sorted(x for x in os.listdir(root) if os.path.isdir(os.path.join(root, x))):
+            with Kaggle.lock(root, folder):
+                for file_path in sorted(gb.glob(os.path.join(root, folder, '*.csv'))):
+                    stats = Export.read_stats(file_path)
+                    if stats is None:
+                        digest = hashlib.sha256()
+                        with open(file_path, 'rb') as f:
+                            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                                digest.update(chunk)
+                        stats = {'hash': digest.hexdigest()}
+                    hashes[os.path.relpath(file_path, root)] = stats['hash']
+
+        return hashes
+
+    def stage(self, root, hashes, state):
+        path = os.path.join(os.path.dirname(root), 'cache', 'kaggle', 'stage')
+        os.makedirs(path, exist_ok=True)
+
+        # group hashes by directory
+        folders = {}
+        for file_path, digest in hashes.items():
+            folders.setdefault(os.path.dirname(file_path), {})[file_path] = digest
+
+        # compress changed directories only
+        for folder, digests in folders.items():
+            archive = os.path.join(path, f'{folder}.zip')
+            if state.get('folders', {}).get(folder) != digests or not os.path.exists(archive):
+                with Kaggle.lock(root, folder), zipfile.ZipFile(f'{archive}.tmp', 'w', zipfile.ZIP_DEFLATED) as z:
+                    for file_path in sorted(gb.glob(os.path.join(root, folder, '*'))):
+                        z.write(file_path, os.path.basename(file_path))
+                os.replace(f'{archive}.tmp', archive)
+
+        # remove deleted directories
+        for archive in gb.glob(os.path.join(path, '*.zip')):
+            if os.path.splitext(os.path.basename(archive))[0] not in folders:
+                os.remove(archive)
+
+        # copy top level files
+        for file_path in gb.glob(os.path.join(root, '*')):
+            if os.path.isfile(file_path):
+                shutil.copy2(file_path, path)
+
+        return path, folders
+
     def upload(self, path):
-        return self.kaggle.dataset_create_version(path, version_notes=self.update(root=path), dir_mode='zip')
+        state_path = os.path.join(os.path.dirname(path), 'cache', 'kaggle', 'state.json')
+
+        # read last published state
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+
+        # skip unchanged dataset
+        hashes = self.hashes(path)
+        digest = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode('utf-8')).hexdigest()
+        if digest == state.get('hash'):
+            return False
+
+        # stage and upload archives
+        notes = self.update(root=path)
+        stage, folders = self.stage(path, hashes, state)
+        timer = Timer()
+        self.kaggle.dataset_create_version(stage, version_notes=notes, dir_mode='skip')
+
+        # upload metrics
+        Metrics.observe('upload_seconds', timer.stop(run=False) / 1000, source='kaggle')
+        Metrics.count('bytes_written', sum(os.path.getsize(x) for x in gb.glob(os.path.join(stage, '*'))), source='kaggle')
+        Metrics.count('uploads', source='kaggle')
+
+        # save published state
+        with open(f'{state_path}.tmp', 'w') as f:
+            json.dump({'hash': digest, 'folders': folders}, f, indent=4)
+        os.replace(f'{state_path}.tmp', state_path)
+
+        return True
+
+
+class LocalApi(object):
+    def __init__(self, path):
+        self.path = path
+
+    def authenticate(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def versions(self):
+        return sorted(int(x) for x in os.listdir(self.path) if x.isdigit())
+
+    def dataset_create_version(self, folder, version_notes, dir_mode='skip', **kwargs):
+        versions = self.versions()
+        path = os.path.join(self.path, str(versions[-1] + 1 if any(versions) else 1))
+        os.makedirs(path)
+
+        # store uploaded files like kaggle does
+        for name in os.listdir(folder):
+            file_path = os.path.join(folder, name)
+            if os.path.isfile(file_path):
+                shutil.copy2(file_path, path)
+            elif dir_mode == 'zip':
+                shutil.make_archive(os.path.join(path, name), 'zip', root_dir=file_path)
+        with open(os.path.join(path, 'version_notes.txt'), 'w') as f:
+            f.write(version_notes)
+
+        return {'status': 'ok', 'version': os.path.basename(path)}
+
+    def dataset_download_files(self, dataset, path=None, quiet=True, force=False, unzip=False):
+        versions = self.versions()
+        if not any(versions):
+            raise ValueError(f'{dataset} has no versions')
+
+        # copy latest version
+        source = os.path.join(self.path, str(versions[-1]))
+        for name in os.listdir(source):
+            file_path = os.path.join(source, name)
+            if unzip and name.endswith('.zip'):
+                shutil.unpack_archive(file_path, os.path.join(path, os.path.splitext(name)[0]))
+            else:
+                shutil.copy2(file_path, path)
@@ -0,0 +1,92 @@
+import time
+
+from threading import Lock
+from urllib.parse import urlparse
+
+from helper.sleep import Sleep
+
+
+class Limiter(object):
+
+    # host limiters
+    hosts = {}
+    hosts_lock = Lock()
+
+    def __init__(self, host, rate, burst):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+
+        # token bucket
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+        # backoff state
+        self.blocked = 0
+        self.backoff = 0
+
+        self.lock = Lock()
+
+    @staticmethod
+    def shared(url, config, key=None):
+        host = urlparse(url).netloc or url
+
+        # shared limiter per host or per host quota key
+        name = f'{host}/{key}' if key else host
+        with Limiter.hosts_lock:
+            if name not in Limiter.hosts:
+                limits = config.get('limiter', {})
+                params = {'rate': 1, 'burst': 1, **limits.get('default', {}), **limits.get(host, {})}
+                Limiter.hosts[name] = Limiter(host, params['rate'], params['burst'])
+            return Limiter.hosts[name]
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self):
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+
+                # take token
+                wait = self.blocked - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                # wait for next token
+                if wait <= 0:
+                    wait = (1 - self.tokens) / self.rate
+
+            Sleep(wait)
+            waited += wait
+
+    def update(self, remaining=None, reset=None, retry=None):
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            # back off on too many requests
+            if retry is not None:
+                self.backoff = min(max(self.backoff * 2, 1), 300)
+                self.blocked = now + max(float(retry), self.backoff)
+                self.tokens = 0
+                return
+            self.backoff = 0
+
+            # validate headers
+            if remaining is None or reset is None:
+                return
+            remaining = float(remaining)
+            reset = max(float(reset), 1)
+
+            # spread remaining quota over reset window
+            if remaining < 1:
+                self.blocked = now + reset
+                self.tokens = 0
+            else:
+                self.rate = remaining / reset
+                self.tokens = min(self.tokens, remaining)
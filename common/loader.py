@@ -1,11 +1,20 @@
 from threading import Thread, Event
 
 from helper.sleep import Sleep
+from helper.timer import Timer
 from common.store import Store
+from common.buffer import Buffer
 from common.logger import Logger
+from common.metrics import Metrics
+from common.limiter import Limiter
+from common.session import Session
 
 
 class Loader(Thread, Logger, Store):
+
+    # concurrency per source
+    slots = {}
+
     def __init__(self, name, root, config, subreddit):
         Thread.__init__(self, name=name)
         Logger.__init__(self, name=name, context=f'r/{subreddit}', plain=False)
@@ -15,6 +24,9 @@ class Loader(Thread, Logger, Store):
         self.runevent = Event()
         self.stopevent = Event()
 
+        # write buffers
+        self.buffers = {}
+
         # time helpers
         self.time = Sleep(10, immediate=False)
 
@@ -27,6 +39,62 @@ class Loader(Thread, Logger, Store):
     def alive(self):
         return self.is_alive()
 
+    def acquire(self):
+        # wait for free slot of own source, long backfills do not block other sources
+        slots = Loader.slots.get(self.name)
+        while slots and not self.stopped():
+            if slots.acquire(timeout=1):
+                return True
+        return not self.stopped()
+
+    def release(self):
+        slots = Loader.slots.get(self.name)
+        if slots:
+            slots.release()
+
+    def request(self, url):
+        limiter = Limiter.shared(url, self.config)
+
+        # wait for rate limit
+        Metrics.count('ratelimit_seconds', limiter.acquire(), **self.labels())
+
+        # request data
+        timer = Timer()
+        Metrics.count('requests', **self.labels())
+        try:
+            with Timer.span('request'):
+                response = Session.shared(url, self.config).get(url)
+        except Exception:
+            Metrics.count('errors', **self.labels())
+            raise
+        Metrics.observe('request_seconds', timer.stop(run=False) / 1000, **self.labels())
+        Metrics.count('bytes_read', len(response.content), **self.labels())
+
+        # adapt rate limit
+        if response.status_code == 429:
+            limiter.update(retry=response.headers.get('Retry-After', 0))
+        else:
+            limiter.update(remaining=response.headers.get('X-Ratelimit-Remaining'), reset=response.headers.get('X-Ratelimit-Reset'))
+
+        # failed requests
+        if response.status_code >= 400:
+            Metrics.count('errors', **self.labels())
+
+        response.raise_for_status()
+        return response
+
+    def buffer(self, name):
+        if name not in self.buffers:
+            params = {'rows': 10000, 'bytes': 32 * 1024 * 1024, 'seconds': 300, **self.config[self.name].get('buffer', {})}
+            self.buffers[name] = Buffer(self, name, params['rows'], params['bytes'], params['seconds'])
+        return self.buffers[name]
+
+    def flush(self):
+        for name, buffer in list(self.buffers.items()):
+            count = buffer.flush()
+            if count:
+                self.log(f'exported {count} {name}s')
+
     def run(self):
         raise NotImplementedError()
 
@@ -39,3 +107,6 @@ class Loader(Thread, Logger, Store):
 
         if self.alive():
             self.join(timeout)
+
+        # persist buffered data
+        self.flush()
@@ -0,0 +1,61 @@
+import os
+import fcntl
+
+from threading import Lock, RLock
+
+
+class FileLock(object):
+
+    # shared locks
+    paths = {}
+    paths_lock = Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+        # thread lock and hold depth of the owning thread
+        self.lock = RLock()
+        self.depth = 0
+        self.file = None
+
+    @staticmethod
+    def shared(path):
+        path = os.path.abspath(path)
+        with FileLock.paths_lock:
+            if path not in FileLock.paths:
+                FileLock.paths[path] = FileLock(path)
+            return FileLock.paths[path]
+
+    def acquire(self):
+        self.lock.acquire()
+
+        # lock file across processes on first hold
+        if self.depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, 'a')
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except Exception:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                self.lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+
+        # unlock file on last release
+        if self.depth == 0:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
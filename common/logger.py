@@ -1,10 +1,33 @@
 import os
+import json
+import atexit
 import syslog
 
+from queue import Queue, Empty
+from threading import Thread, Lock
 from datetime import datetime
 
 
 class Logger(object):
+
+    # log levels
+    levels = {
+        'debug': 10,
+        'info': 20,
+        'warning': 30,
+        'error': 40
+    }
+
+    # sinks
+    level = 'info'
+    jsonl = None
+    system = True
+
+    # writer thread
+    queue = Queue()
+    writer = None
+    writer_lock = Lock()
+
     def __init__(self, name, context, plain):
         self.pid = os.getpid()
         self.name = name
@@ -25,6 +48,12 @@ class Logger(object):
             RESET='\033[0m'
         )
 
+    @staticmethod
+    def configure(level='info', jsonl=None, system=True):
+        Logger.level = level
+        Logger.jsonl = jsonl
+        Logger.system = system
+
     def color(self):
         return {
             'pushshift': self.colors['GREEN'],
@@ -33,8 +62,8 @@ class Logger(object):
             'main': self.colors['YELLOW']
         }[self.name]
 
-    def text(self, colored=True):
-        time = f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
+    def text(self, colored=True, time=None):
+        time = f'{(time or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")}'
         pid = f'{self.pid}'
         name = f'{self.name:^9}'
         context = f'{self.context}'
@@ -47,10 +76,84 @@ class Logger(object):
 
         return f'{time} | {pid} | {name} | {context} '
 
-    def log(self, text):
-        if self.plain:
-            print(f'{self.color()}{text}{self.colors["RESET"]}')
-            syslog.syslog(f'{text}'.replace('\n', ''))
-        else:
-            print(f'{self.text(colored=True)}{text}')
-            syslog.syslog(f'{self.text(colored=False)}{text}'.replace('\n', ''))
+    def log(self, text, level='info'):
+        # filter before formatting
+        if Logger.levels[level] < Logger.levels[Logger.level]:
+            return
+
+        # hand over to writer thread
+        Logger.open()
+        Logger.queue.put((self, datetime.now(), level, text))
+
+    @staticmethod
+    def open():
+        with Logger.writer_lock:
+            if Logger.writer is None or not Logger.writer.is_alive():
+                Logger.writer = Thread(target=Logger.loop, name='logger', daemon=True)
+                Logger.writer.start()
+
+    @staticmethod
+    def drain():
+        # wait for pending records
+        if Logger.writer is not None and Logger.writer.is_alive():
+            Logger.queue.join()
+
+    @staticmethod
+    def loop():
+        while True:
+            records = [Logger.queue.get()]
+
+            # drain pending records
+            try:
+                while len(records) < 1000:
+                    records.append(Logger.queue.get_nowait())
+            except Empty:
+                pass
+
+            try:
+                Logger.write_console(records)
+                if Logger.system:
+                    Logger.write_syslog(records)
+                if Logger.jsonl:
+                    Logger.write_json(records)
+            except Exception as e:
+                print(f'...log error {repr(e)}')
+            finally:
+                for _ in records:
+                    Logger.queue.task_done()
+
+    @staticmethod
+    def write_console(records):
+        lines = []
+        for logger, time, level, text in records:
+            if logger.plain:
+                lines.append(f'{logger.color()}{text}{logger.colors["RESET"]}')
+            else:
+                lines.append(f'{logger.text(colored=True, time=time)}{text}')
+        print('\n'.join(lines), flush=True)
+
+    @staticmethod
+    def write_syslog(records):
+        for logger, time, level, text in records:
+            priority = syslog.LOG_ERR if level == 'error' else syslog.LOG_WARNING if level == 'warning' else syslog.LOG_INFO
+            if logger.plain:
+                syslog.syslog(priority, f'{text}'.replace('\n', ''))
+            else:
+                syslog.syslog(priority, f'{logger.text(colored=False, time=time)}{text}'.replace('\n', ''))
+
+    @staticmethod
+    def write_json(records):
+        lines = [json.dumps({
+            'time': time.isoformat(),
+            'pid': logger.pid,
+            'name': logger.name,
+            'context': logger.context,
+            'level': level,
+            'message': f'{text}'.strip('\n')
+        }) for logger, time, level, text in records]
+        with open(Logger.jsonl, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+# write pending records on exit
+atexit.register(Logger.drain)
@@ -0,0 +1,170 @@
+import os
+
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Metrics(object):
+
+    # counters
+    counters = {
+        'requests': 'http requests',
+        'errors': 'failed http requests',
+        'retries': 'retried fetches',
+        'rows_fetched': 'rows fetched from apis',
+        'rows_written': 'rows written to parquet',
+        'bytes_read': 'bytes read from apis',
+        'bytes_written': 'bytes written to parquet and uploads',
+        'ratelimit_seconds': 'seconds waited for rate limits',
+        'uploads': 'kaggle dataset versions',
+        'refresh_changed': 'changed items found by praw refreshes',
+        'refresh_calls': 'api calls spent on praw refreshes'
+    }
+
+    # latency histograms
+    histograms = {
+        'request_seconds': 'http request latency',
+        'write_seconds': 'parquet write duration',
+        'upload_seconds': 'kaggle upload duration'
+    }
+    buckets = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+    # registry
+    values = {}
+    values_lock = Lock()
+
+    # http endpoint
+    server = None
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    @staticmethod
+    def count(name, value=1, **labels):
+        key = Metrics.key(name, labels)
+        with Metrics.values_lock:
+            Metrics.values[key] = Metrics.values.get(key, 0) + value
+
+    @staticmethod
+    def observe(name, seconds, **labels):
+        key = Metrics.key(name, labels)
+        with Metrics.values_lock:
+            # bucket counts, sum and count
+            if key not in Metrics.values:
+                Metrics.values[key] = [[0] * len(Metrics.buckets), 0, 0]
+            value = Metrics.values[key]
+            for i, bound in enumerate(Metrics.buckets):
+                if seconds <= bound:
+                    value[0][i] += 1
+                    break
+            value[1] += seconds
+            value[2] += 1
+
+    @staticmethod
+    def collect():
+        with Metrics.values_lock:
+            return {k: [list(v[0]), v[1], v[2]] if isinstance(v, list) else v for k, v in Metrics.values.items()}
+
+    @staticmethod
+    def merge(values):
+        # add values recorded in another process
+        with Metrics.values_lock:
+            for key, value in values.items():
+                if not isinstance(value, list):
+                    Metrics.values[key] = Metrics.values.get(key, 0) + value
+                elif key not in Metrics.values:
+                    Metrics.values[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current = Metrics.values[key]
+                    current[0] = [x + y for x, y in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+
+    @staticmethod
+    def reset():
+        with Metrics.values_lock:
+            Metrics.values = {}
+
+    @staticmethod
+    def labels(labels, **extra):
+        labels = list(labels) + list(extra.items())
+        if not any(labels):
+            return ''
+        return '{' + ','.join(f'{k}="{Metrics.escape(v)}"' for k, v in labels) + '}'
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def render():
+        values = Metrics.collect()
+
+        # prometheus text format
+        lines = []
+        for name, description in Metrics.counters.items():
+            lines.append(f'# HELP reddit_{name}_total {description}')
+            lines.append(f'# TYPE reddit_{name}_total counter')
+            for (key, labels), value in sorted(values.items()):
+                if key == name:
+                    lines.append(f'reddit_{name}_total{Metrics.labels(labels)} {value:g}')
+
+        for name, description in Metrics.histograms.items():
+            lines.append(f'# HELP reddit_{name} {description}')
+            lines.append(f'# TYPE reddit_{name} histogram')
+            for (key, labels), value in sorted(values.items()):
+                if key != name:
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, x in zip(Metrics.buckets, counts):
+                    cumulative += x
+                    lines.append(f'reddit_{name}_bucket{Metrics.labels(labels, le=f"{bound:g}")} {cumulative}')
+                lines.append(f'reddit_{name}_bucket{Metrics.labels(labels, le="+Inf")} {count}')
+                lines.append(f'reddit_{name}_sum{Metrics.labels(labels)} {total:g}')
+                lines.append(f'reddit_{name}_count{Metrics.labels(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def write(path):
+        # atomic textfile for the node exporter textfile collector
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(Metrics.render())
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def serve(port, host='127.0.0.1'):
+        if Metrics.server is not None:
+            return
+
+        # local http endpoint
+        Metrics.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=Metrics.server.serve_forever, name='metrics', daemon=True).start()
+
+    @staticmethod
+    def shutdown():
+        if Metrics.server is not None:
+            Metrics.server.shutdown()
+            Metrics.server.server_close()
+            Metrics.server = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+
+        body = Metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep request logs out of the console
+        pass
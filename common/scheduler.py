@@ -0,0 +1,67 @@
+from threading import BoundedSemaphore
+
+from helper.timer import Timer
+from common.loader import Loader
+from common.logger import Logger
+
+
+class Scheduler(Logger):
+    def __init__(self, root, config, subreddits, loaders, concurrency):
+        Logger.__init__(self, name='main', context='scheduler', plain=True)
+
+        self.root = root
+        self.config = config
+        self.subreddits = subreddits
+        self.loaders = loaders
+
+        # concurrency per source
+        Loader.slots = {loader.__name__.lower(): BoundedSemaphore(concurrency) for loader in loaders}
+
+        # loader threads
+        self.threads = {}
+        self.crashes = {}
+
+    def start(self):
+        for subreddit in self.subreddits:
+            for loader in self.loaders:
+                self.spawn(loader, subreddit)
+
+    def spawn(self, loader, subreddit):
+        try:
+            # start loader thread
+            thread = loader(self.root, self.config, subreddit)
+            thread.daemon = True
+            thread.start()
+
+            self.threads[(loader, subreddit)] = thread
+            self.crashes.pop((loader, subreddit), None)
+
+        except Exception as e:
+            self.log(f'...spawn error {loader.__name__.lower()} r/{subreddit} {repr(e)}', level='error')
+            self.crashes[(loader, subreddit)] = Timer()
+
+    def watch(self):
+        # collect crashed loaders
+        for key, thread in list(self.threads.items()):
+            if not thread.alive() and not thread.stopped():
+                self.log(f'...loader {thread.name} r/{thread.subreddit} crashed', level='error')
+                self.threads.pop(key)
+                self.crashes[key] = Timer()
+
+        # restart crashed loaders after their periode
+        for (loader, subreddit), timer in list(self.crashes.items()):
+            periode = self.config[loader.__name__.lower()]['periode']
+            if timer.stop(run=False) / 1000 > periode:
+                self.spawn(loader, subreddit)
+
+    def stop(self, timeout=None):
+        threads = list(self.threads.values())
+
+        # signal all loaders
+        for thread in threads:
+            thread.stopevent.set()
+            thread.time.wake()
+
+        # wait for loaders
+        for thread in threads:
+            thread.stop(timeout)
@@ -0,0 +1,81 @@
+class Schema(object):
+
+    # declared datatypes per file type
+    types = {
+        'submission': {
+            'submission': 'object',
+            'subreddit': 'category',
+            'author': 'category',
+            'created': 'uint32',
+            'retrieved': 'uint32',
+            'edited': 'uint32',
+            'pinned': 'bool',
+            'archived': 'bool',
+            'locked': 'bool',
+            'removed': 'bool',
+            'deleted': 'bool',
+            'is_self': 'bool',
+            'is_video': 'bool',
+            'is_original_content': 'bool',
+            'title': 'object',
+            'link_flair_text': 'category',
+            'upvote_ratio': 'float32',
+            'score': 'int32',
+            'gilded': 'int32',
+            'total_awards_received': 'int32',
+            'num_comments': 'int32',
+            'num_crossposts': 'int32',
+            'selftext': 'object',
+            'thumbnail': 'object',
+            'shortlink': 'object'
+        },
+        'comment': {
+            'submission': 'object',
+            'comment': 'object',
+            'subreddit': 'category',
+            'author': 'category',
+            'created': 'uint32',
+            'retrieved': 'uint32'
+        }
+    }
+
+    @staticmethod
+    def name(item):
+        # submission, submission/2022-01, .submission.migrate -> submission
+        return item.split('/')[0].lstrip('.').split('.')[0]
+
+    @staticmethod
+    def dtypes(name, columns=None):
+        dtypes = Schema.types.get(Schema.name(name), {})
+        if columns is None:
+            return dict(dtypes)
+        return {column: dtypes.get(column, 'object') for column in columns}
+
+    @staticmethod
+    def apply(df, name):
+        dtypes = {k: v for k, v in Schema.dtypes(name).items() if k in df.columns and df[k].dtype != v}
+        if not any(dtypes):
+            return df
+
+        # missing numbers and flags default to zero
+        numbers = [k for k, v in dtypes.items() if v not in ['object', 'category']]
+        df = df.fillna({k: 0 for k in numbers}) if any(numbers) else df.copy()
+
+        # nullable strings and merged categories
+        for column in [k for k, v in dtypes.items() if v in ['object', 'category']]:
+            df[column] = df[column].astype('object').where(df[column].notna(), None)
+
+        return df.astype(dtypes)
+
+    @staticmethod
+    def plain(df):
+        # categories as plain values, e.g. before merging frames
+        return df.astype({k: 'object' for k in df.columns if df[k].dtype == 'category'})
+
+    @staticmethod
+    def csv(df):
+        # shortest float32 representation
+        df = df.assign(**{k: df[k].astype('str').astype('float64') for k in df.columns if df[k].dtype == 'float32'})
+
+        # flags as 0/1 numbers
+        return df.astype({k: 'int8' for k in df.columns if df[k].dtype == 'bool'})
@@ -0,0 +1,48 @@
+import requests
+
+from threading import Lock
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from helper.env import Env
+
+
+class Session(requests.Session):
+
+    # host sessions
+    hosts = {}
+    hosts_lock = Lock()
+
+    def __init__(self, pool, timeout, retries):
+        requests.Session.__init__(self)
+
+        # request timeout (connect, read)
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+
+        # keep-alive connection pool
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=retries)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        # default headers
+        self.headers.update({
+            'User-Agent': Env.USER_AGENT(),
+            'Accept-Encoding': ACCEPT_ENCODING,
+            'Connection': 'keep-alive'
+        })
+
+    @staticmethod
+    def shared(url, config):
+        host = urlparse(url).netloc or url
+
+        # shared session per host
+        with Session.hosts_lock:
+            if host not in Session.hosts:
+                params = {'pool': 4, 'timeout': [10, 30], 'retries': 2, **config.get('session', {})}
+                Session.hosts[host] = Session(params['pool'], params['timeout'], params['retries'])
+            return Session.hosts[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return requests.Session.request(self, method, url, **kwargs)
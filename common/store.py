@@ -1,11 +1,34 @@
 import os
+import sys
+import json
+import shutil
+import argparse
 
 import glob as gb
 import pandas as pd
 import pystore as db
+import fastparquet as fp
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
+sys.path.insert(0, root)                                               # nopep8
+
+from helper.timer import Timer
+from common.lock import FileLock
+from common.index import Index
+from common.schema import Schema
+from common.logger import Logger
+from common.metrics import Metrics
 
 
 class Store(object):
+
+    # partition key formats
+    formats = {
+        'year': '%Y',
+        'month': '%Y-%m',
+        'day': '%Y-%m-%d'
+    }
+
     def __init__(self, name, root, config, subreddit):
         self.name = name
         self.root = root
@@ -20,32 +43,376 @@ class Store(object):
         self.collection = self.datastore.collection(self.name)
         self.path = os.path.join(self.datastore.datastore, self.collection.collection)
 
+        # partition layout
+        self.partition = self.config.get(self.name, {}).get('partition')
+
+        # compaction threshold
+        self.threshold = self.config.get('store', {}).get('fragments', 32)
+
+        # subreddit lock across threads and processes
+        self.lock = FileLock.shared(os.path.join(self.datastore.datastore, '.lock'))
+
+        # recover interrupted writes
+        with self.lock:
+            self.recover()
+
     def exists_meta(self, name):
         path = os.path.join(self.path, name)
         return any(gb.glob(os.path.join(path, '*.json')))
 
     def read_meta(self, name):
-        if self.exists_meta(name):
-            return db.utils.read_metadata(os.path.join(self.path, name))
-        return {}
+        with self.lock:
+            if self.exists_meta(name):
+                return db.utils.read_metadata(os.path.join(self.path, name))
+            return {}
 
     def write_meta(self, name, **kwargs):
+        with self.lock:
+            path = os.path.join(self.path, name)
+            os.makedirs(path, exist_ok=True)
+            db.utils.write_metadata(path, metadata=kwargs)
+
+    def exists_flat(self, name):
         path = os.path.join(self.path, name)
-        os.makedirs(path, exist_ok=True)
-        db.utils.write_metadata(path, metadata=kwargs)
+        return any(gb.glob(os.path.join(path, '*.parquet')))
+
+    def fragments(self, item):
+        return sorted(gb.glob(os.path.join(self.path, item, 'part.*.parquet')), key=lambda x: int(x.split('.')[-2]))
+
+    def index(self, name):
+        index = Index.shared(os.path.join(self.path, f'{name}.index'))
+
+        # build missing index from stored ids
+        if not index.exists() and self.exists_data(name):
+            index.reset(self.read_data(name, columns=[]).index)
+
+        return index
+
+    def known(self, name, ids):
+        with self.lock:
+            return self.index(name).contains(ids)
 
     def exists_data(self, name):
+        return self.exists_flat(name) or any(self.partitions(name))
+
+    def layout(self, name):
+        # layout of existing data
+        keys = self.partitions(name)
+        if any(keys):
+            return Store.granularity(keys[0])
+        if self.exists_flat(name):
+            return None
+
+        # layout of new data
+        return self.partition
+
+    def partitioned(self, name):
+        return self.layout(name) is not None
+
+    def partitions(self, name, since=None, until=None):
         path = os.path.join(self.path, name)
-        return any(gb.glob(os.path.join(path, '*.parquet')))
+        keys = sorted({os.path.basename(os.path.dirname(x)) for x in gb.glob(os.path.join(path, '*', '*.parquet'))})
+        if not any(keys):
+            return keys
+
+        # skip partitions outside of time window
+        layout = Store.granularity(keys[0])
+        if since is not None:
+            keys = [x for x in keys if x >= Store.partition_key(since, layout)]
+        if until is not None:
+            keys = [x for x in keys if x <= Store.partition_key(until, layout)]
+
+        return keys
+
+    @staticmethod
+    def granularity(key):
+        return ['year', 'month', 'day'][key.count('-')]
+
+    @staticmethod
+    def partition_key(timestamp, layout):
+        return pd.Timestamp(int(timestamp), unit='s', tz='UTC').strftime(Store.formats[layout])
+
+    @staticmethod
+    def partition_keys(data, layout):
+        created = pd.to_datetime(data['created'].astype('int64'), unit='s', utc=True)
+        return created.dt.strftime(Store.formats[layout])
+
+    def read_data(self, name, since=None, until=None, columns=None):
+        with self.lock:
+            # partitioned data
+            if self.partitioned(name):
+                keys = self.partitions(name, since=since, until=until)
+                if not any(keys):
+                    return pd.DataFrame()
+                return Schema.apply(pd.concat([self.read_item(f'{name}/{key}', since, until, columns) for key in keys]), name)
+
+            # flat data
+            if self.exists_flat(name):
+                return self.read_item(name, since, until, columns)
+            return pd.DataFrame()
+
+    def read_partition(self, name, key):
+        with self.lock:
+            if os.path.isdir(os.path.join(self.path, name, key)):
+                return self.read_item(f'{name}/{key}')
+            return pd.DataFrame()
+
+    def read_item(self, item, since=None, until=None, columns=None):
+        filters = []
+        if since is not None:
+            filters.append(('created', '>=', since))
+        if until is not None:
+            filters.append(('created', '<', until))
 
-    def read_data(self, name):
-        if self.exists_data(name):
-            return self.collection.item(name).to_pandas(parse_dates=False)
-        return pd.DataFrame()
+        # project columns, keep created for filtering
+        projection = None
+        if columns is not None:
+            projection = list(dict.fromkeys(list(columns) + (['created'] if any(filters) else [])))
+
+        # skip row groups by parquet statistics
+        df = self.collection.item(item, filters=filters or None, columns=projection).to_pandas(parse_dates=False)
+
+        # drop duplicates, last writer wins
+        df = df[~df.index.duplicated(keep='last')]
+
+        # filter remaining rows
+        if since is not None:
+            df = df[df['created'] >= since]
+        if until is not None:
+            df = df[df['created'] < until]
+        if columns is not None:
+            df = df[list(columns)]
+
+        # enforce declared datatypes
+        return Schema.apply(df, item)
 
     def write_data(self, name, data, overwrite, **kwargs):
-        if overwrite or not self.exists_data(name):
-            self.collection.write(name, data, overwrite=True, metadata=kwargs)
-        else:
-            self.collection.append(name, data)
+        with self.lock:
+            # temporary items have no index
+            indexed = not name.startswith('.')
+
+            # enforce declared datatypes
+            data = Schema.apply(data, name)
+
+            # drop already stored items
+            if indexed and not overwrite:
+                data = data[~data.index.duplicated(keep='last')]
+                data = data[~self.known(name, data.index)]
+                if data.empty:
+                    self.write_meta(name, **kwargs)
+                    return
+
+            # partitioned data
+            layout = self.layout(name)
+            if layout is not None:
+                if overwrite:
+                    for key in self.partitions(name):
+                        shutil.rmtree(os.path.join(self.path, name, key))
+                for key, df in data.groupby(Store.partition_keys(data, layout)):
+                    if os.path.isdir(os.path.join(self.path, name, key)):
+                        self.append_item(f'{name}/{key}', df)
+                    else:
+                        self.write_item(f'{name}/{key}', df)
+                self.write_meta(name, **kwargs)
+
+            # flat data
+            elif overwrite or not self.exists_flat(name):
+                self.write_item(name, data, metadata=kwargs)
+            else:
+                self.append_item(name, data)
+                self.write_meta(name, **kwargs)
+
+            # update index
+            if indexed and overwrite:
+                Index.shared(os.path.join(self.path, f'{name}.index')).reset(data.index)
+            elif indexed:
+                self.index(name).add(data.index)
+
+    def append_item(self, item, data):
+        path = os.path.join(self.path, item)
+
+        # validate data
+        if data.empty:
+            return
+
+        # next fragment number
+        fragments = self.fragments(item)
+        number = int(fragments[-1].split('.')[-2]) + 1 if any(fragments) else 0
+
+        # stale dataset metadata would hide new fragments
+        for meta in ['_metadata', '_common_metadata']:
+            if os.path.exists(os.path.join(path, meta)):
+                os.remove(os.path.join(path, meta))
+
+        # write fragment atomically
+        timer = Timer()
+        temp = os.path.join(path, f'.part.{number}.tmp')
+        with Timer.span('parquet'):
+            fp.write(temp, data, compression='SNAPPY')
+        self.measure(data, os.path.getsize(temp), timer)
+        os.replace(temp, os.path.join(path, f'part.{number}.parquet'))
+
+        # compact fragments above threshold
+        if len(fragments) + 1 > self.threshold:
+            self.compact_item(item)
+
+    def write_item(self, item, data, **kwargs):
+        timer = Timer()
+        with Timer.span('parquet'):
+            self.collection.write(item, data, overwrite=True, **kwargs)
+
+        # size of rewritten item
+        size = sum(os.path.getsize(x) for x in gb.glob(os.path.join(self.path, item, '*.parquet')))
+        self.measure(data, size, timer)
+
+    def measure(self, data, size, timer):
+        # parquet write metrics
+        Metrics.observe('write_seconds', timer.stop(run=False) / 1000, **self.labels())
+        Metrics.count('rows_written', data.shape[0], **self.labels())
+        Metrics.count('bytes_written', size, **self.labels())
+
+    def labels(self):
+        return {'source': self.name, 'subreddit': self.subreddit}
+
+    def upsert(self, name, data, **kwargs):
+        with self.lock:
+            # flat data
+            layout = self.layout(name)
+            if layout is None:
+                df = self.read_data(name)
+                self.write_data(name, Store.merge(df, data), overwrite=True, **kwargs)
+                return []
+
+            # partitioned data, rewrite touched partitions only
+            keys = []
+            ids = data.index[~self.known(name, data.index)]
+            for key, df_update in data.groupby(Store.partition_keys(data, layout)):
+                with Timer.span('read_data'):
+                    df = self.read_partition(name, key)
+                with Timer.span('merge'):
+                    df = Store.merge(df, df_update)
+                with Timer.span('dtypes'):
+                    df = Schema.apply(df, name)
+
+                # rewrite partition into temporary item and replace it
+                temp = f'{name}/.{key}.upsert'
+                shutil.rmtree(os.path.join(self.path, temp), ignore_errors=True)
+                self.write_item(temp, df)
+                self.swap(f'{name}/{key}', temp)
+                keys.append(key)
             self.write_meta(name, **kwargs)
+
+            # update index
+            self.index(name).add(ids)
+
+            return keys
+
+    def compact(self, name):
+        with self.lock:
+            items = [f'{name}/{key}' for key in self.partitions(name)] if self.partitioned(name) else [name]
+
+            # compact fragmented items
+            count = 0
+            for item in items:
+                if len(self.fragments(item)) > 1:
+                    self.compact_item(item)
+                    count += 1
+
+            return count
+
+    def compact_item(self, item):
+        path = os.path.join(self.path, item)
+        meta = {k: v for k, v in db.utils.read_metadata(path).items() if not k.startswith('_')}
+
+        # merge fragments, last writer wins
+        df = self.read_item(item).sort_values(by=['created', 'retrieved'])
+
+        # rewrite data into temporary item
+        temp = os.path.join(os.path.dirname(item), f'.{os.path.basename(item)}.compact')
+        shutil.rmtree(os.path.join(self.path, temp), ignore_errors=True)
+        self.collection.write(temp, df, overwrite=True, metadata=meta)
+
+        # replace item
+        self.swap(item, temp)
+
+    def migrate(self, name):
+        with self.lock:
+            # validate layout
+            if not self.exists_data(name) or self.layout(name) == self.partition:
+                return False
+
+            # rewrite data into temporary item
+            temp = f'.{name}.migrate'
+            shutil.rmtree(os.path.join(self.path, temp), ignore_errors=True)
+            df = self.read_data(name).sort_values(by=['created', 'retrieved'])
+            meta = {k: v for k, v in self.read_meta(name).items() if not k.startswith('_')}
+            self.write_data(temp, df, overwrite=True, **meta)
+
+            # replace item
+            self.swap(name, temp)
+
+            return True
+
+    def swap(self, item, temp):
+        path = os.path.join(self.path, item)
+        old = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.old')
+
+        # move new item in place
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(os.path.join(self.path, temp), path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def recover(self):
+        paths = [self.path] + [x for x in gb.glob(os.path.join(self.path, '*')) if os.path.isdir(x)]
+
+        for path in paths:
+            # roll back interrupted swaps
+            for old in gb.glob(os.path.join(path, '.*.old')):
+                item = os.path.join(path, os.path.basename(old)[1:-len('.old')])
+                if os.path.exists(item):
+                    shutil.rmtree(old)
+                else:
+                    os.rename(old, item)
+
+            # remove temporary items
+            for temp in gb.glob(os.path.join(path, '.*.compact')) + gb.glob(os.path.join(path, '.*.migrate')) + gb.glob(os.path.join(path, '.*.upsert')):
+                shutil.rmtree(temp)
+            for temp in gb.glob(os.path.join(path, '.part.*.tmp')) + gb.glob(os.path.join(path, '*', '.part.*.tmp')):
+                os.remove(temp)
+
+    @staticmethod
+    def merge(df, df_update):
+        if df.empty:
+            return df_update
+
+        # update existing items, categories as plain values
+        df, df_update = Schema.plain(df), Schema.plain(df_update)
+        df = df.combine_first(df_update)
+        df.update(df_update)
+
+        return df
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser()
+    argp.add_argument('subreddits', type=str, nargs='+', help='subreddits to migrate to the configured partition layout')
+    argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
+    argp.add_argument('-compact', action='store_true', default=False, help='merge fragmented items into single files')
+    args = argp.parse_args()
+
+    # load config
+    with open(os.path.join(root, args.config)) as f:
+        config = json.load(f)
+
+    # migrate stores
+    for subreddit in args.subreddits:
+        logger = Logger('main', f'r/{subreddit}', plain=False)
+        for name in ['pushshift', 'crawler', 'praw']:
+            store = Store(name, root, config, subreddit)
+            for file_type in config[name]['types']:
+                layout = store.layout(file_type)
+                if store.migrate(file_type):
+                    logger.log(f'migrated {name} {file_type}s from {layout or "flat"} to {store.partition or "flat"} layout')
+                if args.compact:
+                    logger.log(f'compacted {store.compact(file_type)} {name} {file_type} items')
@@ -0,0 +1,63 @@
+import multiprocessing as mp
+
+from concurrent.futures import ProcessPoolExecutor
+
+from helper.timer import Timer
+from common.metrics import Metrics
+
+
+class Worker(object):
+
+    # process pool
+    pool = None
+
+    @staticmethod
+    def start(workers):
+        # spawned processes do not inherit locks held by loader threads
+        if workers:
+            Worker.pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'), initializer=Worker.init, initargs=(Timer.profile,))
+
+    @staticmethod
+    def init(profile):
+        # profiling spans in worker processes
+        Timer.profile = profile
+
+    @staticmethod
+    def stop():
+        if Worker.pool:
+            Worker.pool.shutdown(wait=True)
+            Worker.pool = None
+
+    @staticmethod
+    def run(function, *args):
+        # run cpu stage in worker process or inline
+        if Worker.pool is None:
+            return function(*args)
+        result, metrics, spans = Worker.pool.submit(Worker.call, Timer.path(), function, *args).result()
+        Metrics.merge(metrics)
+        Timer.merge(spans)
+        return result
+
+    @staticmethod
+    def map(function, items):
+        if Worker.pool is None:
+            return list(map(function, items))
+        items, results = list(items), []
+        for result, metrics, spans in Worker.pool.map(Worker.call, [Timer.path()] * len(items), [function] * len(items), items):
+            Metrics.merge(metrics)
+            Timer.merge(spans)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def call(path, function, *args):
+        # hand metrics and spans of worker process back to the main process
+        Metrics.reset()
+        Timer.clear()
+
+        # nest spans below the calling span
+        Timer.local.path = tuple(path)
+        try:
+            return function(*args), Metrics.collect(), Timer.collect()
+        finally:
+            Timer.local.path = ()
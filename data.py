@@ -6,8 +6,12 @@ import argparse
 
 from helper.env import Env
 from helper.sleep import Sleep
-from common.kaggle import Kaggle
+from helper.timer import Timer
+from common.kaggle import Kaggle, LocalApi
 from common.logger import Logger
+from common.worker import Worker
+from common.metrics import Metrics
+from common.scheduler import Scheduler
 
 from loader.praw import Praw
 from loader.crawler import Crawler
@@ -18,9 +22,9 @@ terminated = False
 
 
 def terminate(sig, frm):
+    # only flag termination, logging could block on locks held by the interrupted main thread
     global terminated
     terminated = True
-    logger.log(f'\n{"-"*45}{"TERMINATED":^15}{"-"*45}\n')
 
 
 def fetch(config, subreddit):
@@ -40,24 +44,51 @@ def fetch(config, subreddit):
         praw = Praw(root, config, subreddit)
         loaders.append(praw)
 
-        # start loader threads
-        background = False  # TODO thread implementation
+        # run loaders once
         for loader in loaders:
-            if background:
-                loader.start()
-            else:
-                loader.run()
-
-        # wait until abort
-        while background:
-            Sleep(1)
+            loader.run()
 
     except KeyboardInterrupt:
         for loader in loaders:
             loader.stop(1)
         raise KeyboardInterrupt()
     except Exception as e:
-        logger.log(f'...fetch error {repr(e)}')
+        logger.log(f'...fetch error {repr(e)}', level='error')
+
+
+def export(path):
+    logger = Logger('main', 'metrics', plain=True)
+
+    try:
+        # export disabled
+        if not path:
+            return
+
+        # write metrics textfile
+        Metrics.write(path)
+
+    except Exception as e:
+        logger.log(f'...metrics error {repr(e)}', level='error')
+
+
+def profile(path):
+    logger = Logger('main', 'profile', plain=True)
+
+    try:
+        # profiling disabled
+        if not Timer.profile:
+            return
+
+        # per phase breakdown
+        logger.log(f'\n{"-"*45}{"PROFILE":^15}{"-"*45}\n')
+        logger.log(Timer.report())
+
+        # collapsed stacks
+        if path:
+            Timer.write(path)
+
+    except Exception as e:
+        logger.log(f'...profile error {repr(e)}', level='error')
 
 
 def publish(interval, kaggle):
@@ -76,12 +107,14 @@ def publish(interval, kaggle):
         elapsed = kaggle.timer.stop(run=False) / 1000
         if elapsed > interval:
             logger.log(f'\n{"-"*45}{"UPLOADING":^15}{"-"*45}\n')
-            kaggle.upload(path)
-            logger.log(f'\n{"-"*45}{"PUBLISHED":^15}{"-"*45}\n')
+            if kaggle.upload(path):
+                logger.log(f'\n{"-"*45}{"PUBLISHED":^15}{"-"*45}\n')
+            else:
+                logger.log(f'\n{"-"*45}{"UNCHANGED":^15}{"-"*45}\n')
             kaggle.timer.reset()
 
     except Exception as e:
-        logger.log(f'...publish error {repr(e)}')
+        logger.log(f'...publish error {repr(e)}', level='error')
 
 
 if __name__ == '__main__':
@@ -93,9 +126,24 @@ if __name__ == '__main__':
     argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
     argp.add_argument('-background', action='store_true', default=False, help='run loaders periodically in background')
     argp.add_argument('-publish', type=int, default=None, help='publish datasets to kaggle every x seconds')
+    argp.add_argument('-local', type=str, default=None, help='publish dataset versions to local directory instead of kaggle')
     argp.add_argument('-pause', type=int, default=None, help='pause x seconds after fetching a subreddit')
+    argp.add_argument('-concurrency', type=int, default=4, help='maximum number of loaders per source downloading at the same time')
+    argp.add_argument('-workers', type=int, default=None, help='run merge and export stages in x worker processes')
+    argp.add_argument('-level', type=str, default='info', choices=list(Logger.levels), help='minimum level of log messages')
+    argp.add_argument('-json', type=str, default=None, help='append log messages as json lines to file path')
+    argp.add_argument('-nosyslog', action='store_true', default=False, help='do not write log messages to syslog')
+    argp.add_argument('-metrics', type=str, default=None, help='write prometheus metrics to textfile path')
+    argp.add_argument('-port', type=int, default=None, help='serve prometheus metrics on local port')
+    argp.add_argument('-profile', type=str, nargs='?', const='', default=None, help='print timing spans on shutdown, optionally write collapsed stacks to file path')
     args = argp.parse_args()
 
+    # configure log sinks
+    Logger.configure(level=args.level, jsonl=args.json, system=not args.nosyslog)
+
+    # profiling spans
+    Timer.profile = args.profile is not None
+
     # handle process termination
     signal.signal(signal.SIGTERM, terminate)
 
@@ -110,15 +158,48 @@ if __name__ == '__main__':
             config = json.load(f)
 
         # kaggle client
-        kaggle = Kaggle(config=os.path.join('config', 'kaggle.json'))
+        kaggle = Kaggle(config=os.path.join('config', 'kaggle.json'), api=LocalApi(args.local) if args.local else None) if args.publish else None
 
-        # start background tasks
-        while not terminated:
+        # worker processes
+        Worker.start(args.workers)
+
+        # metrics endpoint
+        if args.port:
+            Metrics.serve(args.port)
+        timer = Timer()
+
+        # start background loaders
+        if args.background:
+            scheduler = Scheduler(root, config, args.subreddits, [Pushshift, Crawler, Praw], args.concurrency)
+            try:
+                scheduler.start()
+                while not terminated:
+                    # restart crashed loaders
+                    scheduler.watch()
+
+                    # publish data
+                    if args.publish and kaggle.timer.stop(run=False) / 1000 > args.publish:
+                        publish(args.publish, kaggle)
+
+                    # export metrics
+                    if timer.stop(run=False) / 1000 > 10:
+                        export(args.metrics)
+                        timer.reset()
+
+                    Sleep(1)
+            finally:
+                scheduler.stop(1)
+
+        # start sequential tasks
+        while not terminated and not args.background:
 
             for subreddit in args.subreddits:
                 # fetch data
                 fetch(config, subreddit)
 
+                # export metrics
+                export(args.metrics)
+
                 # pause requests
                 if args.pause:
                     logger.log(f'\n{"-"*45}{"PAUSING":^15}{"-"*45}\n')
@@ -136,6 +217,12 @@ if __name__ == '__main__':
     except KeyboardInterrupt as e:
         logger.log(f'...aborted')
     except Exception as e:
-        logger.log(f'...error {repr(e)}')
+        logger.log(f'...error {repr(e)}', level='error')
     finally:
+        if terminated:
+            logger.log(f'\n{"-"*45}{"TERMINATED":^15}{"-"*45}\n')
+        Worker.stop()
+        export(args.metrics)
+        Metrics.shutdown()
+        profile(args.profile)
         logger.log(f'\n{"-"*45}{"STOPPED":^15}{"-"*45}\n')
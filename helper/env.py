@@ -1,13 +1,36 @@
 import os
 
-import streamlit as st
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
 
 
 class Env(object):
 
+    # secrets files, later files take precedence
+    paths = [
+        os.path.join(os.path.expanduser('~'), '.streamlit', 'secrets.toml'),
+        os.path.join(os.getcwd(), '.streamlit', 'secrets.toml')
+    ]
+    secrets = None
+
     @staticmethod
     def init():
-        return list(st.secrets.keys())
+        if Env.secrets is None:
+            secrets = {}
+            for path in Env.paths:
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        secrets.update(tomllib.load(f))
+
+            # export root keys, environment variables take precedence
+            for key, value in secrets.items():
+                if not isinstance(value, dict):
+                    os.environ.setdefault(key, str(value))
+            Env.secrets = secrets
+
+        return list(Env.secrets.keys())
 
     @staticmethod
     def get(environment, key):
@@ -15,30 +38,42 @@ class Env(object):
             return environment[key]
         raise KeyError(f'{key} not found in environment variables')
 
+    @staticmethod
+    def environ():
+        Env.init()
+        return os.environ
+
     @staticmethod
     def USER_AGENT():
-        return Env.get(st.secrets, 'USER_AGENT')
+        return Env.get(Env.environ(), 'USER_AGENT')
 
     @staticmethod
     def REDDIT_CLIENT_ID():
-        return Env.get(st.secrets, 'REDDIT_CLIENT_ID')
+        return Env.get(Env.environ(), 'REDDIT_CLIENT_ID')
 
     @staticmethod
     def REDDIT_CLIENT_SECRET():
-        return Env.get(st.secrets, 'REDDIT_CLIENT_SECRET')
+        return Env.get(Env.environ(), 'REDDIT_CLIENT_SECRET')
+
+    @staticmethod
+    def REDDIT_CREDENTIALS():
+        credentials = [(Env.REDDIT_CLIENT_ID(), Env.REDDIT_CLIENT_SECRET())]
+
+        # additional credentials numbered from 2
+        while f'REDDIT_CLIENT_ID_{len(credentials) + 1}' in Env.environ():
+            number = len(credentials) + 1
+            credentials.append((Env.get(Env.environ(), f'REDDIT_CLIENT_ID_{number}'), Env.get(Env.environ(), f'REDDIT_CLIENT_SECRET_{number}')))
+
+        return credentials
 
     @staticmethod
     def KAGGLE_USERNAME():
-        return Env.get(st.secrets, 'KAGGLE_USERNAME')
+        return Env.get(Env.environ(), 'KAGGLE_USERNAME')
 
     @staticmethod
     def KAGGLE_KEY():
-        return Env.get(st.secrets, 'KAGGLE_KEY')
+        return Env.get(Env.environ(), 'KAGGLE_KEY')
 
     @staticmethod
     def VSCODE_WORKSPACE():
         return Env.get(os.environ, 'VSCODE_WORKSPACE')
-
-
-# init on import
-Env.init()
@@ -1,7 +1,16 @@
 import datetime
 
+from threading import Lock, local
+
 
 class Timer(object):
+
+    # profiling spans
+    profile = False
+    spans = {}
+    spans_lock = Lock()
+    local = local()
+
     def __init__(self, run=True):
         self.reset(run=run)
 
@@ -35,3 +44,105 @@ class Timer(object):
     @staticmethod
     def stamp():
         return datetime.datetime.now()
+
+    @staticmethod
+    def span(name, path=None):
+        # nested timing span, no-op unless profiling
+        return Span(name, path) if Timer.profile else Span.disabled
+
+    @staticmethod
+    def path():
+        return getattr(Timer.local, 'path', ())
+
+    @staticmethod
+    def record(path, ms):
+        with Timer.spans_lock:
+            count, total = Timer.spans.get(path, (0, 0))
+            Timer.spans[path] = (count + 1, total + ms)
+
+    @staticmethod
+    def collect():
+        with Timer.spans_lock:
+            return dict(Timer.spans)
+
+    @staticmethod
+    def clear():
+        with Timer.spans_lock:
+            Timer.spans = {}
+
+    @staticmethod
+    def merge(spans):
+        # add spans recorded in another process
+        with Timer.spans_lock:
+            for path, (count, total) in spans.items():
+                count_before, total_before = Timer.spans.get(path, (0, 0))
+                Timer.spans[path] = (count_before + count, total_before + total)
+
+    @staticmethod
+    def report():
+        spans = Timer.collect()
+
+        # direct children of a span, incl. spans still open
+        def children(parent):
+            return {x[:len(parent) + 1] for x in spans if len(x) > len(parent) and x[:len(parent)] == parent}
+
+        # calls and total time, open spans sum up their children
+        def measure(path):
+            return spans[path] if path in spans else (0, sum(measure(x)[1] for x in children(path)))
+
+        # per phase breakdown, children sorted by total time
+        lines = [f'{"span":<48} {"calls":>8} {"total":>12} {"mean":>10} {"parent":>7}']
+
+        def walk(path, parent):
+            count, total = measure(path)
+            mean = f'{total / count:8.1f}ms' if count else ''
+            share = f'{total / parent * 100:6.1f}%' if parent else ''
+            lines.append(f'{"  " * (len(path) - 1) + path[-1]:<48} {count:>8} {total:10.1f}ms {mean:>10} {share:>7}')
+            for child in sorted(children(path), key=lambda x: measure(x)[1], reverse=True):
+                walk(child, total)
+        for path in sorted(children(()), key=lambda x: measure(x)[1], reverse=True):
+            walk(path, None)
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def write(path):
+        spans = Timer.collect()
+
+        # collapsed stacks with self time in microseconds, e.g. for flamegraph.pl or speedscope
+        lines = []
+        for stack, (count, total) in sorted(spans.items()):
+            inner = sum(v[1] for k, v in spans.items() if k[:-1] == stack)
+            lines.append(f'{";".join(stack)} {max(int((total - inner) * 1000), 0)}')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+class Span(object):
+    def __init__(self, name, path=None):
+        self.name = name
+        self.base = path
+
+    def __enter__(self):
+        self.parent = Timer.path()
+
+        # nest below current span or explicit parent path, e.g. from another thread
+        Timer.local.path = (self.parent if self.base is None else tuple(self.base)) + (self.name,)
+        self.timer = Timer()
+        return self
+
+    def __exit__(self, *args):
+        Timer.record(Timer.local.path, self.timer.stop(run=False))
+        Timer.local.path = self.parent
+
+
+class NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+# shared no-op span
+Span.disabled = NoSpan()
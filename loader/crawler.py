@@ -1,31 +1,44 @@
+import io
 import os
 import sys
 import json
-import requests
 import argparse
 
 import pandas as pd
 
-from lxml import html
+from lxml import etree
 from datetime import datetime, timezone
+from urllib.parse import urlparse, urlencode, parse_qsl
 
 root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
 sys.path.insert(0, root)                                               # nopep8
 
-from helper.env import Env
 from helper.sleep import Sleep
+from helper.timer import Timer
 from common.loader import Loader
+from common.logger import Logger
+from common.metrics import Metrics
 
 
 class Crawler(Loader):
+
+    # listing endpoints
+    endpoints = {
+        'html': 'https://old.reddit.com/r/{}/new/',
+        'json': 'https://old.reddit.com/r/{}/new/.json?limit=100&raw_json=1'
+    }
+
     def __init__(self, root, config, subreddit):
         Loader.__init__(self, 'crawler', root, config, subreddit)
 
-        self.endpoint = 'https://old.reddit.com/r/{}/new/'
-
         # config parameters
         self.types = self.config['crawler']['types']
         self.periode = self.config['crawler']['periode']
+        self.backend = self.config['crawler'].get('backend', 'html')
+
+        # listing backend
+        self.endpoint = Crawler.endpoints[self.backend]
+        self.parse = getattr(self, f'parse_{self.backend}')
 
         # initial run variables
         self.last_run = {}
@@ -44,8 +57,16 @@ class Crawler(Loader):
         try:
             # download crawler metadata
             while not self.stopped():
-                for file_type in self.types:
-                    self.download(file_type)
+
+                # wait for free slot
+                if not self.acquire():
+                    break
+                try:
+                    for file_type in self.types:
+                        with Timer.span(self.name):
+                            self.download(file_type)
+                finally:
+                    self.release()
 
                 # periodic run
                 if self.alive():
@@ -58,7 +79,7 @@ class Crawler(Loader):
             self.runevent.clear()
             raise KeyboardInterrupt()
         except Exception as e:
-            self.log(f'...run error {repr(e)}')
+            self.log(f'...run error {repr(e)}', level='error')
 
         self.runevent.clear()
 
@@ -73,11 +94,14 @@ class Crawler(Loader):
 
         # fetch data
         url = self.endpoint.format(self.subreddit)
-        data = self.fetch(url, file_type, [])
+        with Timer.span('fetch'):
+            data = self.fetch(url, file_type)
 
         # build dataframe and sort
-        df = pd.DataFrame(data, columns=columns).set_index(file_type)
-        df = df.sort_values(by=['created', 'retrieved'])
+        with Timer.span('frame'):
+            df = pd.DataFrame(data, columns=columns).set_index(file_type)
+        with Timer.span('sort'):
+            df = df.sort_values(by=['created', 'retrieved'])
 
         # validate data
         if df.empty:
@@ -88,49 +112,100 @@ class Crawler(Loader):
         self.last_run[file_type] = int(df.iloc[-1]['created'])
 
         # append data
-        self.write_data(file_type, df, overwrite=False, last_run=self.last_run[file_type])
+        with Timer.span('write_data'):
+            self.write_data(file_type, df, overwrite=False, last_run=self.last_run[file_type])
         self.log(f'exported {df.shape[0]} {file_type}s')
 
-    def fetch(self, url, file_type, data=[]):
+    def fetch(self, url, file_type):
+        data = []
         try:
-            now = datetime.now(timezone.utc).timestamp()
-
-            # terminate
-            created = [x[3] for x in data]
-            if len(created) and created[-1] <= self.last_run[file_type]:
-                return [x for x in data if x[3] > self.last_run[file_type]]
-
-            # request data
-            response = requests.get(url, headers={'User-Agent': Env.USER_AGENT()}).content
-            content = html.fromstring(response)
-
-            # parse submissions
-            things = content.xpath('.//div[contains(@class,"thing") and @data-fullname]')
-            data += [[
-                x.get('data-fullname').partition('_')[2].strip(),
-                self.subreddit,
-                x.get('data-author'),
-                int(x.get('data-timestamp')) // 1000,
-                int(now)
-            ] for x in things if x.get('data-fullname').startswith('t3_')]
-
-            # fetched data
-            created = [x[3] for x in data]
-            self.log(f'fetched {len(data)} {file_type}s after {datetime.fromtimestamp(created[-1]).strftime("%Y-%m-%d %H:%M:%S")}')
-
-            # wait for next request
-            Sleep(0.35)
-
-            # parse next url
-            url_next = content.xpath('.//a[contains(@rel,"next") and @href]/@href')
-            if len(url_next):
-                return self.fetch(url_next[0], file_type, data)
+            for things, now in self.pages(url):
+
+                # parse submissions until last run
+                done = False
+                for x in things:
+                    if x['created'] <= self.last_run[file_type] and not x['pinned']:
+                        done = True
+                        break
+                    data.append([x['id'], self.subreddit, x['author'], x['created'], int(now)])
+
+                # fetched data
+                if len(data):
+                    self.log(f'fetched {len(data)} {file_type}s after {datetime.fromtimestamp(data[-1][3]).strftime("%Y-%m-%d %H:%M:%S")}', level='debug')
+
+                # terminate
+                if done:
+                    break
 
         except Exception as e:
-            self.log(f'...request error {repr(e)}, retry')
+            self.log(f'...request error {repr(e)}, retry', level='warning')
+            Metrics.count('retries', **self.labels())
             Sleep(1)
 
-        return [x for x in data if x[3] > self.last_run[file_type]]
+        data = [x for x in data if x[3] > self.last_run[file_type]]
+        Metrics.count('rows_fetched', len(data), **self.labels())
+
+        return data
+
+    def pages(self, url):
+        while url and not self.stopped():
+            now = datetime.now(timezone.utc).timestamp()
+
+            # request data
+            response = self.request(url).content
+
+            # parse page
+            things, url_next = [], None
+            with Timer.span('parse'):
+                for tag, value in self.parse(response, url):
+                    if tag == 'thing':
+                        things.append(value)
+                    else:
+                        url_next = value
+            url = url_next
+
+            yield things, now
+
+    @staticmethod
+    def parse_html(content, url):
+        # stream matching elements instead of building the full tree
+        for _, element in etree.iterparse(io.BytesIO(content), events=('end',), tag=('div', 'a'), html=True, recover=True, no_network=True):
+            classes = (element.get('class') or '').split()
+            if element.tag == 'div' and 'thing' in classes and (element.get('data-fullname') or '').startswith('t3_'):
+                yield 'thing', {
+                    'id': element.get('data-fullname').partition('_')[2].strip(),
+                    'author': element.get('data-author'),
+                    'created': int(element.get('data-timestamp')) // 1000,
+                    'pinned': 'stickied' in classes or element.get('data-promoted') == 'true'
+                }
+            elif element.tag == 'a' and 'next' in (element.get('rel') or '').split() and element.get('href'):
+                yield 'next', element.get('href')
+
+            # free parsed elements
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    @staticmethod
+    def parse_json(content, url):
+        listing = json.loads(content)['data']
+
+        # parse listing children
+        for child in listing['children']:
+            x = child['data']
+            if child['kind'] == 't3':
+                yield 'thing', {
+                    'id': x['id'],
+                    'author': x.get('author'),
+                    'created': int(x['created_utc']),
+                    'pinned': bool(x.get('stickied') or x.get('promoted'))
+                }
+
+        # build next url
+        if listing.get('after'):
+            parts = urlparse(url)
+            query = urlencode({**dict(parse_qsl(parts.query)), 'after': listing['after']})
+            yield 'next', parts._replace(query=query).geturl()
 
 
 if __name__ == '__main__':
@@ -138,15 +213,28 @@ if __name__ == '__main__':
     argp.add_argument('subreddit', type=str, help='subreddit to fetch data from')
     argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
     argp.add_argument('-background', action='store_true', default=False, help='run loaders periodically in background')
+    argp.add_argument('-profile', type=str, nargs='?', const='', default=None, help='print timing spans on shutdown, optionally write collapsed stacks to file path')
     args = argp.parse_args()
 
+    # profiling spans
+    Timer.profile = args.profile is not None
+
     # load config
     with open(os.path.join(root, args.config)) as f:
         config = json.load(f)
 
     # start crawler
     crawler = Crawler(root, config, args.subreddit)
-    if args.background:
-        crawler.start()
-    else:
-        crawler.run()
+    try:
+        if args.background:
+            crawler.start()
+            if Timer.profile:
+                crawler.join()
+        else:
+            crawler.run()
+    finally:
+        # profile breakdown
+        if Timer.profile:
+            Logger('main', 'profile', plain=True).log(Timer.report())
+            if args.profile:
+                Timer.write(args.profile)
@@ -1,39 +1,47 @@
 import os
 import sys
-import csv
 import json
+import time
 import argparse
 
+import numpy as np
 import pandas as pd
 
 from tqdm import tqdm
-from praw import Reddit
+from queue import Queue
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 
 root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
 sys.path.insert(0, root)                                               # nopep8
 
 from helper.env import Env
 from helper.sleep import Sleep
+from helper.timer import Timer
 from common.store import Store
+from common.export import Export
+from common.worker import Worker
+from common.metrics import Metrics
+from common.schema import Schema
+from common.builder import Builder
 from common.loader import Loader
+from common.logger import Logger
+from common.limiter import Limiter
 
 
 class Praw(Loader):
     def __init__(self, root, config, subreddit):
         Loader.__init__(self, 'praw', root, config, subreddit)
 
-        self.endpoint = {
-            'user_agent': Env.USER_AGENT(),
-            'client_id': Env.REDDIT_CLIENT_ID(),
-            'client_secret': Env.REDDIT_CLIENT_SECRET()
-        }
-        self.reddit = Reddit(**self.endpoint)
-
         # config parameters
         self.types = self.config['praw']['types']
         self.periode = self.config['praw']['periode']
         self.retrospect_time = self.config['praw']['retrospect_time']
+        self.budget = self.config['praw'].get('budget')
+        self.workers = self.config['praw'].get('workers', 1)
+
+        # reddit clients, created on first fetch
+        self.clients = None
 
         # initial run variables
         self.last_run = {}
@@ -56,8 +64,16 @@ class Praw(Loader):
                     Store('crawler', self.root, self.config, self.subreddit),
                     Store('pushshift', self.root, self.config, self.subreddit)
                 ]
-                for file_type in self.types:
-                    self.download(file_type, stores)
+
+                # wait for free slot
+                if not self.acquire():
+                    break
+                try:
+                    for file_type in self.types:
+                        with Timer.span(self.name):
+                            self.download(file_type, stores)
+                finally:
+                    self.release()
 
                 # periodic run
                 if self.alive():
@@ -70,7 +86,7 @@ class Praw(Loader):
             self.runevent.clear()
             raise KeyboardInterrupt()
         except Exception as e:
-            self.log(f'...run error {repr(e)}')
+            self.log(f'...run error {repr(e)}', level='error')
 
         self.runevent.clear()
 
@@ -98,105 +114,224 @@ class Praw(Loader):
             ]
         }[file_type]
 
-        # read existing data
-        df = self.read_data(file_type)
-        if df.empty:
-            df = pd.DataFrame(columns=columns).set_index(file_type)
-        df = df.sort_values(by=['created', 'retrieved'])
+        # read high-water marks of reconciled items
+        marks = self.read_meta(file_type).get('marks', {})
 
-        # load metadata
-        idxs = list(df.index)
+        # collect candidates of all stores
+        df_windows = {}
         for store in stores:
-            df_store = store.read_data(file_type)
-
-            # validate dataset
-            if df_store.empty:
-                continue
-            df_store = df_store.sort_values(by=['created', 'retrieved'])
-
-            # obtain existing items
-            df_store_existing = df_store[df_store.index.isin(idxs)]
-            df_store_existing = df_store_existing.sort_values(by=['created', 'retrieved'])
+            if store.name not in marks:
+                marks[store.name] = self.mark(file_type, store)
 
             # update last x hours based on retrospect time sliding window
-            last_time = df_store.iloc[0]['created'] if df_store_existing.empty else df_store_existing.iloc[-1]['created']
-            update_time = last_time - (60 * 60 * self.retrospect_time)
-
-            self.log(f'update data after {datetime.fromtimestamp(update_time)} from {store.name}')
-
-            # obtain fetch ids
-            prefix = {
-                'submission': 't3_',
-                'comment': 't1_'
-            }
-            df_store_update = df_store[df_store['created'] >= update_time]
-            ids = list(prefix[file_type] + df_store_update.index)
-
-            # process submissions
-            if file_type == 'submission':
-
-                # fetch data
-                data = self.fetch(file_type, ids)
-
-                # update submission data
-                df_update = pd.DataFrame(data, columns=columns).set_index(file_type)
-                df = df.combine_first(df_update)
-                df.update(df_update)
-
-                # updated data
-                self.log(f'updated {df_update.shape[0]} {file_type}s')
+            update_time = None if marks[store.name] is None else marks[store.name] - (60 * 60 * self.retrospect_time)
+            with Timer.span('read_data'):
+                df_windows[store.name] = store.read_data(file_type, since=update_time, columns=['created'])
+        df_candidates = pd.concat(list(df_windows.values()))
+        df_candidates = df_candidates[~df_candidates.index.duplicated(keep='first')]
+
+        # spend api budget on items most likely to have changed
+        with Timer.span('prioritize'):
+            ids, df_before = self.prioritize(file_type, df_candidates, now)
+
+        # process submissions
+        df_update = Builder(Schema.dtypes(file_type, columns)).frame(file_type)
+        if len(ids):
+            self.log(f'update {len(ids)} of {df_candidates.shape[0]} {file_type}s after {datetime.fromtimestamp(int(df_candidates["created"].min()))}')
+
+            # fetch data
+            with Timer.span('fetch'):
+                df_update = self.fetch(file_type, list('t3_' + ids), columns)
+            self.log(f'updated {df_update.shape[0]} {file_type}s')
+
+            # changed items per api call
+            with Timer.span('reconcile'):
+                changed = self.changed(df_before, df_update)
+            calls = -(-len(ids) // 100)
+            Metrics.count('refresh_changed', changed, **self.labels())
+            Metrics.count('refresh_calls', calls, **self.labels())
+            self.log(f'refreshed {changed} changed {file_type}s with {calls} calls ({changed / calls:.1f} per call)')
+
+        # advance high-water marks below the oldest skipped new or failed item
+        with Timer.span('reconcile'):
+            self.advance(file_type, df_windows, ids, df_update.index, marks)
+
+        # combine updates
+        with Timer.span('dtypes'):
+            df_update = df_update[~df_update.index.duplicated(keep='last')]
+            df_update = Schema.apply(df_update, file_type)
+
+        # write and export updated partitions
+        with Timer.span('write'):
+            Worker.run(Praw.write, self.root, self.config, self.subreddit, file_type, df_update, {'last_run': self.last_run[file_type], 'marks': marks})
+        self.log(f'exported {df_update.shape[0]} {file_type}s')
+
+    def advance(self, file_type, df_windows, ids, fetched, marks):
+        for name, df_window in df_windows.items():
+            # only items returned by the api are reconciled
+            reconciled = df_window.index.isin(fetched)
+            df_reconciled = df_window[reconciled]
+            if not df_reconciled.empty:
+                marks[name] = int(max(marks[name] or 0, df_reconciled['created'].max()))
+
+            # unseen items over budget and requested items that did not come back
+            df_skipped = df_window[~reconciled]
+            if not df_skipped.empty:
+                df_skipped = df_skipped[df_skipped.index.isin(ids) | ~self.known(file_type, df_skipped.index)]
+            if not df_skipped.empty and marks[name] is not None:
+                marks[name] = int(min(marks[name], df_skipped['created'].min() - 1))
+
+    @staticmethod
+    def write(root, config, subreddit, file_type, data, meta):
+        store = Store('praw', root, config, subreddit)
+
+        # write updated partitions
+        with Timer.span('upsert'):
+            keys = store.upsert(file_type, data, **meta)
+
+        # export updated partitions
+        with Timer.span('export'):
+            return Export(store, file_type).run(keys)
+
+    def prioritize(self, file_type, df_candidates, now):
+        fields = ['created', 'retrieved', 'score', 'num_comments', 'upvote_ratio', 'edited', 'locked', 'removed', 'deleted']
+        df_before = pd.DataFrame(columns=fields)
+        if df_candidates.empty or file_type != 'submission':
+            return pd.Index([]), df_before
+
+        # unlimited budget refreshes all candidates
+        budget = len(df_candidates) if self.budget is None else self.budget * 100
+        known = self.known(file_type, df_candidates.index)
+
+        # new items first, oldest first
+        df_new = df_candidates[~known].sort_values(by='created')
+        ids = df_new.index[:budget]
+
+        # stored state of known items
+        if known.any():
+            df_before = self.read_data(file_type, since=int(df_candidates['created'].min()), columns=fields)
+            df_before = df_before[df_before.index.isin(df_candidates.index[known])]
+
+        # known items by expected change: activity per hour of age times hours since last retrieval
+        if len(ids) < budget and not df_before.empty:
+            df = df_before.astype({'created': 'int64', 'retrieved': 'int64', 'score': 'int64', 'num_comments': 'int64'})
+            age = np.maximum(now - df['created'], 60) / 3600
+            stale = np.maximum(now - df['retrieved'], 0) / 3600
+            velocity = (df['score'].abs() + df['num_comments']) / age
+            priority = (velocity + 1) * stale / age
+            ids = ids.append(priority.nlargest(budget - len(ids)).index)
+
+        return ids, df_before[df_before.index.isin(ids)]
+
+    @staticmethod
+    def changed(df_before, df_update):
+        # count refreshed items with modified fields, new items count as changed
+        df_after = df_update[df_before.columns.drop(['retrieved'])]
+        df_known = df_after[df_after.index.isin(df_before.index)]
+        df_old = df_before.loc[df_known.index, df_known.columns]
+        modified = (df_known.astype('float64') != df_old.astype('float64')).any(axis=1).sum()
+        return int(modified + (df_after.shape[0] - df_known.shape[0]))
+
+    def mark(self, file_type, store):
+        # derive high-water mark once from the id index
+        if not self.exists_data(file_type):
+            return None
+        df_store = store.read_data(file_type, columns=['created'])
+        if df_store.empty:
+            return None
+        df_store = df_store[self.known(file_type, df_store.index)]
+        return None if df_store.empty else int(df_store['created'].max())
+
+    def fetch(self, file_type, ids, columns):
+        # column builders
+        builder = Builder(Schema.dtypes(file_type, columns))
 
-        # convert datatypes
-        df = df.convert_dtypes()
-        df = df.sort_values(by=['created', 'retrieved'])
-
-        # write data
-        self.write_data(file_type, df, overwrite=True, last_run=self.last_run[file_type])
-        self.log(f'exported {df.shape[0]} {file_type}s')
-
-        # export data
-        file_path = os.path.join(self.root, 'data', 'export', self.subreddit, f'{file_type}.csv')
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        df.to_csv(file_path, header=True, index=True, doublequote=True, quoting=csv.QUOTE_NONNUMERIC, sep=',', encoding='utf-8')
-
-    def fetch(self, file_type, ids):
         try:
-            data = []
+            # create reddit clients
+            if self.clients is None:
+                self.connect()
 
             # chunk id's into batches of size 100
             self.log(f'download {len(ids)} {file_type}s')
             batches = [ids[i:i + 100] for i in range(0, len(ids), 100)]
-            for fullnames in tqdm(batches, desc=self.text() + 'fetching', unit_scale=100):
-                now = datetime.now(timezone.utc).timestamp()
-
-                # process submissions
-                if file_type == 'submission':
 
-                    # request data
-                    submissions = self.reddit.info(fullnames=fullnames)
+            # fetch batches in parallel, keep batch order
+            path = Timer.path()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'{self.name}-fetch') as executor:
+                for now, submissions in tqdm(executor.map(lambda x: self.fetch_batch(file_type, x, path), batches), total=len(batches), desc=self.text() + 'fetching', unit_scale=100):
 
                     # parse submissions
-                    data += [[
-                        str(x.id), str(self.subreddit), str(x.author.name if x.author else '[deleted]'),
-                        int(x.created_utc), int(now), int(x.edited),
-                        int(x.pinned), int(x.archived), int(x.locked),
-                        int(x.selftext == '[removed]' or x.removed_by_category != None), int(x.selftext == '[deleted]'),
-                        int(x.is_self), int(x.is_video), int(x.is_original_content),
-                        str(x.title), str(x.link_flair_text), float(x.upvote_ratio), int(x.score),
-                        int(x.gilded), int(x.total_awards_received), int(x.num_comments), int(x.num_crossposts),
-                        str(x.selftext), str(x.thumbnail), str(x.shortlink)
-                    ] for x in submissions]
-
-                # wait for next request
-                Sleep(0.35)
-
-            return data
+                    for x in submissions:
+                        builder.add(
+                            str(x.id), str(self.subreddit), str(x.author.name if x.author else '[deleted]'),
+                            int(x.created_utc), int(now), int(x.edited),
+                            int(x.pinned), int(x.archived), int(x.locked),
+                            int(x.selftext == '[removed]' or x.removed_by_category != None), int(x.selftext == '[deleted]'),
+                            int(x.is_self), int(x.is_video), int(x.is_original_content),
+                            str(x.title), str(x.link_flair_text), float(x.upvote_ratio), int(x.score),
+                            int(x.gilded), int(x.total_awards_received), int(x.num_comments), int(x.num_crossposts),
+                            str(x.selftext), str(x.thumbnail), str(x.shortlink)
+                        )
+
+            Metrics.count('rows_fetched', len(builder), **self.labels())
+            return builder.frame(file_type)
 
         except Exception as e:
-            self.log(f'...request error {repr(e)}, retry')
+            self.log(f'...request error {repr(e)}, retry', level='warning')
+            Metrics.count('retries', **self.labels())
             Sleep(1)
 
-        return []
+        return Builder(builder.columns).frame(file_type)
+
+    def connect(self):
+        from praw import Reddit
+
+        self.endpoints = [{
+            'user_agent': Env.USER_AGENT(),
+            'client_id': client_id,
+            'client_secret': client_secret
+        } for client_id, client_secret in Env.REDDIT_CREDENTIALS()]
+        self.workers = max(self.workers, len(self.endpoints))
+
+        # reddit clients, one per worker with a rate limit per credential
+        self.clients = Queue()
+        for i in range(self.workers):
+            endpoint = self.endpoints[i % len(self.endpoints)]
+            self.clients.put((Reddit(**endpoint), Limiter.shared('https://oauth.reddit.com', self.config, key=endpoint['client_id'])))
+
+    def fetch_batch(self, file_type, fullnames, path=None):
+        now = datetime.now(timezone.utc).timestamp()
+
+        # process submissions
+        if file_type != 'submission':
+            return now, []
+
+        # borrow idle client
+        reddit, limiter = self.clients.get()
+        try:
+            # wait for rate limit
+            Metrics.count('ratelimit_seconds', limiter.acquire(), **self.labels())
+
+            # request data
+            timer = Timer()
+            Metrics.count('requests', **self.labels())
+            try:
+                with Timer.span('info', path=path):
+                    submissions = list(reddit.info(fullnames=fullnames))
+            except Exception:
+                Metrics.count('errors', **self.labels())
+                raise
+            Metrics.observe('request_seconds', timer.stop(run=False) / 1000, **self.labels())
+
+            # adapt rate limit
+            limits = reddit.auth.limits
+            if limits.get('reset_timestamp'):
+                limiter.update(remaining=limits.get('remaining'), reset=limits['reset_timestamp'] - time.time())
+
+        finally:
+            self.clients.put((reddit, limiter))
+
+        return now, submissions
 
 
 if __name__ == '__main__':
@@ -204,15 +339,28 @@ if __name__ == '__main__':
     argp.add_argument('subreddit', type=str, help='subreddit to fetch data from')
     argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
     argp.add_argument('-background', action='store_true', default=False, help='run loaders periodically in background')
+    argp.add_argument('-profile', type=str, nargs='?', const='', default=None, help='print timing spans on shutdown, optionally write collapsed stacks to file path')
     args = argp.parse_args()
 
+    # profiling spans
+    Timer.profile = args.profile is not None
+
     # load config
     with open(os.path.join(root, args.config)) as f:
         config = json.load(f)
 
     # start praw
     praw = Praw(root, config, args.subreddit)
-    if args.background:
-        praw.start()
-    else:
-        praw.run()
+    try:
+        if args.background:
+            praw.start()
+            if Timer.profile:
+                praw.join()
+        else:
+            praw.run()
+    finally:
+        # profile breakdown
+        if Timer.profile:
+            Logger('main', 'profile', plain=True).log(Timer.report())
+            if args.profile:
+                Timer.write(args.profile)
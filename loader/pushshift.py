@@ -1,19 +1,24 @@
 import os
 import sys
 import json
-import requests
+import shutil
 import argparse
 
 import pandas as pd
 
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # nopep8
 sys.path.insert(0, root)                                               # nopep8
 
-from helper.env import Env
 from helper.sleep import Sleep
+from helper.timer import Timer
 from common.loader import Loader
+from common.logger import Logger
+from common.metrics import Metrics
+from common.schema import Schema
+from common.builder import Builder
 
 
 class Pushshift(Loader):
@@ -25,13 +30,16 @@ class Pushshift(Loader):
         # config parameters
         self.types = self.config['pushshift']['types']
         self.periode = self.config['pushshift']['periode']
+        self.backfill = {'window': None, 'workers': 4, **self.config['pushshift'].get('backfill', {})}
 
         # initial run variables
         self.last_run = {}
         self.end_run = {}
+        self.windows = {}
         for file_type in self.types:
             self.last_run[file_type] = int(datetime.now(timezone.utc).timestamp())
             self.end_run[file_type] = self.config['pushshift']['start_time']
+            self.windows[file_type] = []
 
         # saved run variables
         for file_type in self.types:
@@ -40,6 +48,8 @@ class Pushshift(Loader):
                 self.last_run[file_type] = meta['last_run']
             if 'end_run' in meta:
                 self.end_run[file_type] = meta['end_run']
+            if 'windows' in meta:
+                self.windows[file_type] = meta['windows']
 
     def run(self):
         self.runevent.set()
@@ -47,8 +57,16 @@ class Pushshift(Loader):
         try:
             # download pushshift metadata
             while not self.stopped():
-                for file_type in self.types:
-                    self.download(file_type)
+
+                # wait for free slot
+                if not self.acquire():
+                    break
+                try:
+                    for file_type in self.types:
+                        with Timer.span(self.name):
+                            self.download(file_type)
+                finally:
+                    self.release()
 
                 # periodic run
                 if self.alive():
@@ -61,107 +79,199 @@ class Pushshift(Loader):
             self.runevent.clear()
             raise KeyboardInterrupt()
         except Exception as e:
-            self.log(f'...run error {repr(e)}')
+            self.log(f'...run error {repr(e)}', level='error')
 
         self.runevent.clear()
 
     def download(self, file_type):
-        count = 0
         now = int(datetime.now(timezone.utc).timestamp())
 
         # set last run from now
         if self.last_run[file_type] == self.end_run[file_type]:
             self.last_run[file_type] = now
 
-        self.log(f'download {file_type}s before {datetime.fromtimestamp(self.last_run[file_type]).strftime("%Y-%m-%d %H:%M:%S")}')
+        # split large ranges into time windows
+        window = self.backfill['window']
+        if not any(self.windows[file_type]) and window and self.last_run[file_type] - self.end_run[file_type] > window:
+            bounds = list(range(int(self.end_run[file_type]), int(self.last_run[file_type]), window)) + [int(self.last_run[file_type])]
+            self.windows[file_type] = [[x, y] for x, y in zip(bounds[:-1], bounds[1:])]
+            self.write_meta(file_type, last_run=self.last_run[file_type], end_run=self.end_run[file_type], windows=self.windows[file_type])
 
-        # define columns
-        columns = {
-            'submission': ['submission', 'subreddit', 'author', 'created', 'retrieved'],
-            'comment': ['submission', 'comment', 'subreddit', 'author', 'created', 'retrieved']  # TODO fetch comments
-        }[file_type]
+        # parallel backfill or serial download
+        if any(self.windows[file_type]):
+            count = self.download_windows(file_type)
+        else:
+            count = self.download_serial(file_type)
 
-        while True:
+        # abort on stop
+        if count is None:
+            return
 
-            # fetch data
-            url = self.endpoint.format(file_type, self.subreddit, str(self.end_run[file_type]), str(self.last_run[file_type]))
-            data = self.fetch(url, file_type)
+        # set last run and end run from now
+        self.last_run[file_type] = now
+        if count > 0:
+            self.end_run[file_type] = now
 
-            # validate data
-            if data is None:
-                if count == 0:
-                    self.log(f'exported 0 {file_type}s')
-                break
+        # update state
+        self.write_meta(file_type, last_run=self.last_run[file_type], end_run=self.end_run[file_type])
 
-            # build dataframe and sort
-            df = pd.DataFrame(data, columns=columns).set_index(file_type)
-            df = df.sort_values(by=['created', 'retrieved'])
+    def download_serial(self, file_type):
+        count = 0
+        self.log(f'download {file_type}s before {datetime.fromtimestamp(self.last_run[file_type]).strftime("%Y-%m-%d %H:%M:%S")}')
+
+        buffer = self.buffer(file_type)
+        try:
+            while True:
+
+                # abort on stop
+                if self.stopped():
+                    return None
+
+                # fetch data
+                url = self.endpoint.format(file_type, self.subreddit, str(self.end_run[file_type]), str(self.last_run[file_type]))
+                with Timer.span('fetch'):
+                    df, self.last_run[file_type] = self.fetch(url, file_type, self.last_run[file_type])
+
+                # validate data
+                if df is None:
+                    if count == 0:
+                        self.log(f'exported 0 {file_type}s')
+                    break
 
-            # check result
-            if not df.empty:
+                # sort data
+                with Timer.span('sort'):
+                    df = df.sort_values(by=['created', 'retrieved'])
                 count += df.shape[0]
 
-                # append data
-                self.write_data(file_type, df, overwrite=False, last_run=self.last_run[file_type], end_run=self.end_run[file_type])
-                self.log(f'exported {df.shape[0]} {file_type}s')
+                # buffer data
+                with Timer.span('buffer'):
+                    exported = buffer.add(df, last_run=self.last_run[file_type], end_run=self.end_run[file_type])
+                if exported:
+                    self.log(f'exported {exported} {file_type}s')
 
-            # wait for next request
-            Sleep(0.35)
+        finally:
+            # persist buffered data
+            self.flush()
 
-        # set last run and end run from now
-        self.last_run[file_type] = now
-        if count > 0:
-            self.end_run[file_type] = now
+        return count
 
-        # update state
-        self.write_meta(file_type, last_run=self.last_run[file_type], end_run=self.end_run[file_type])
+    def download_windows(self, file_type):
+        windows = self.windows[file_type]
+        self.log(f'backfill {file_type}s in {len(windows)} windows before {datetime.fromtimestamp(windows[-1][1]).strftime("%Y-%m-%d %H:%M:%S")}')
+
+        # fetch windows concurrently under the shared rate limit
+        count, merged, done, path = 0, 0, {}, Timer.path()
+        with ThreadPoolExecutor(max_workers=self.backfill['workers'], thread_name_prefix=f'{self.name}-backfill') as executor:
+            futures = {executor.submit(self.download_window, file_type, *x, path=path): i for i, x in enumerate(windows)}
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()
+
+                # merge finished windows in order
+                while merged < len(windows) and done.get(merged):
+                    with Timer.span('merge_window'):
+                        count += self.merge_window(file_type, *windows[merged], windows[merged + 1:])
+                    merged += 1
+
+        # keep unfinished windows
+        self.windows[file_type] = windows[merged:]
+
+        return None if any(self.windows[file_type]) else count
+
+    def download_window(self, file_type, after, before, path=None):
+        with Timer.span('download_window', path=path):
+            return self.fetch_window(file_type, after, before)
+
+    def fetch_window(self, file_type, after, before):
+        name = f'.{file_type}.{after}.window'
+
+        # resume from window checkpoint
+        meta = self.read_meta(name)
+        if meta.get('done'):
+            return True
+        cursor = meta.get('before', before + 1)
+
+        buffer = self.buffer(name)
+        try:
+            while not self.stopped():
+
+                # fetch data
+                url = self.endpoint.format(file_type, self.subreddit, str(after), str(cursor))
+                with Timer.span('fetch'):
+                    df, cursor = self.fetch(url, file_type, cursor)
+
+                # validate data
+                if df is None:
+                    buffer.add(pd.DataFrame(), before=cursor, done=True)
+                    return True
+
+                # buffer data with checkpoint
+                buffer.add(df.sort_values(by=['created', 'retrieved']), before=cursor, done=False)
+
+        finally:
+            # persist buffered data and checkpoint
+            buffer.flush()
+            self.buffers.pop(name, None)
+
+        return False
+
+    def merge_window(self, file_type, after, before, windows):
+        name = f'.{file_type}.{after}.window'
+
+        # append window data and remaining windows
+        df = self.read_data(name)
+        if not df.empty:
+            df = df.sort_values(by=['created', 'retrieved'])
+            self.write_data(file_type, df, overwrite=False, last_run=self.last_run[file_type], end_run=self.end_run[file_type], windows=windows)
+        else:
+            self.write_meta(file_type, last_run=self.last_run[file_type], end_run=self.end_run[file_type], windows=windows)
+        self.log(f'exported {df.shape[0]} {file_type}s after {datetime.fromtimestamp(after).strftime("%Y-%m-%d %H:%M:%S")}')
+
+        # remove window
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+        return df.shape[0]
+
+    def fetch(self, url, file_type, before):
+        # column builders
+        builder = Builder(Schema.dtypes(file_type, {
+            'submission': ['submission', 'subreddit', 'author', 'created', 'retrieved'],
+            'comment': ['submission', 'comment', 'subreddit', 'author', 'created', 'retrieved']  # TODO fetch comments
+        }[file_type]))
 
-    def fetch(self, url, file_type):
         try:
             # request data
-            result = requests.get(url, headers={'User-Agent': Env.USER_AGENT()}).json()
+            result = self.request(url).json()
 
             # validate result
             if 'data' not in result or not len(result['data']):
-                self.log(f'fetched 0 {file_type}s after {datetime.fromtimestamp(self.last_run[file_type]).strftime("%Y-%m-%d %H:%M:%S")}')
-                return None
+                self.log(f'fetched 0 {file_type}s after {datetime.fromtimestamp(before).strftime("%Y-%m-%d %H:%M:%S")}', level='debug')
+                return None, before
 
             # build data
-            data = []
-            for x in result['data']:
-
-                # set last run from current item
-                self.last_run[file_type] = x['created_utc'] - 1
-
-                if file_type == 'submission' and 'selftext' in x:
-                    # parse submissions
-                    data += [[
-                        x['id'],
-                        self.subreddit,
-                        x['author'],
-                        x['created_utc'],
-                        x['retrieved_on']
-                    ]]
-                elif file_type == 'comment' and 'body' in x:
-                    # parse comments
-                    data += [[
-                        x['parent_id'].partition('_')[2],
-                        x['id'],
-                        self.subreddit,
-                        x['author'],
-                        x['created_utc'],
-                        x['retrieved_on']
-                    ]]
+            with Timer.span('parse'):
+                for x in result['data']:
+
+                    # set cursor from current item
+                    before = x['created_utc'] - 1
+
+                    if file_type == 'submission' and 'selftext' in x:
+                        # parse submissions
+                        builder.add(x['id'], self.subreddit, x['author'], int(x['created_utc']), int(x['retrieved_on']))
+                    elif file_type == 'comment' and 'body' in x:
+                        # parse comments
+                        builder.add(x['parent_id'].partition('_')[2], x['id'], self.subreddit, x['author'], int(x['created_utc']), int(x['retrieved_on']))
 
             # fetched data
-            self.log(f'fetched {len(data)} {file_type}s after {datetime.fromtimestamp(self.last_run[file_type]).strftime("%Y-%m-%d %H:%M:%S")}')
-            return data
+            Metrics.count('rows_fetched', len(builder), **self.labels())
+            self.log(f'fetched {len(builder)} {file_type}s after {datetime.fromtimestamp(before).strftime("%Y-%m-%d %H:%M:%S")}', level='debug')
+            return builder.frame(file_type), before
 
         except Exception as e:
-            self.log(f'...request error {repr(e)}, retry')
+            self.log(f'...request error {repr(e)}, retry', level='warning')
+            Metrics.count('retries', **self.labels())
             Sleep(1)
 
-        return []
+        return Builder(builder.columns).frame(file_type), before
 
 
 if __name__ == '__main__':
@@ -169,15 +279,28 @@ if __name__ == '__main__':
     argp.add_argument('subreddit', type=str, help='subreddit to fetch data from')
     argp.add_argument('-config', type=str, default=os.path.join('config', 'loader.json'), help='file path of global config file')
     argp.add_argument('-background', action='store_true', default=False, help='run loaders periodically in background')
+    argp.add_argument('-profile', type=str, nargs='?', const='', default=None, help='print timing spans on shutdown, optionally write collapsed stacks to file path')
     args = argp.parse_args()
 
+    # profiling spans
+    Timer.profile = args.profile is not None
+
     # load config
     with open(os.path.join(root, args.config)) as f:
         config = json.load(f)
 
     # start pushshift
     pushshift = Pushshift(root, config, args.subreddit)
-    if args.background:
-        pushshift.start()
-    else:
-        pushshift.run()
+    try:
+        if args.background:
+            pushshift.start()
+            if Timer.profile:
+                pushshift.join()
+        else:
+            pushshift.run()
+    finally:
+        # profile breakdown
+        if Timer.profile:
+            Logger('main', 'profile', plain=True).log(Timer.report())
+            if args.profile:
+                Timer.write(args.profile)